@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
 # This Source Code Form is licensed MPL-2.0: http://mozilla.org/MPL/2.0
-import sys, getopt, re, os
+import sys, getopt, re, os, bisect, fnmatch, array, time
 
 # V1: -k, -d, -p works for `no|<number>{y|m|w|d|h}|latest|all`
+# Library use: `import aging; aging.plan (names, '48h 14d 8w', now = ...)`, importing has no side effects.
 
 from enum import Enum
 class Classification(Enum):
@@ -19,7 +20,6 @@ class Classification(Enum):
   YEAR    = (10, True)
 
 import datetime
-now = datetime.datetime.now()
 
 # Parser for retention configuration
 # Syntax: no|<number>{y|m|w|d|h}|latest|all
@@ -41,7 +41,7 @@ class Retention:
     self.hourly = 0
     self.dayofweek = 6
     for word in string.split():
-      m = re.match (r'(\d+y)|(\d+m)|(\d+w)|(\d+d)|(\d+h)|(latest)|(all)|(no)', word)
+      m = re.match (r'((?:\d+|\*)y)|((?:\d+|\*)m)|((?:\d+|\*)w)|((?:\d+|\*)d)|((?:\d+|\*)h)|(latest)|(all)|(no)', word)
       if not m:         continue
       elif m[1]:        self.yearly = self.asint (m[1][:-1])
       elif m[2]:        self.monthly = self.asint (m[2][:-1])
@@ -63,31 +63,134 @@ class Retention:
     if self.none:     s += [ 'no' ]
     return ' '.join (s)
 
+# Time stamp layouts in filenames, grouped by precedence
+# Template letters: Y=year M=month D=day h=hour m=minute s=second E=epoch seconds,
+# `_` matches any non-digit, other characters match literally.
+nameformats = {
+  'compact':    (('YYYYMMDD_hhmm', 'YYYYMMDDhhmm'), ('YYYYMMDD',)),  # 19991231T2359, 19991231
+  'iso':        (('YYYY-MM-DD_hh:mm:ss', 'YYYY-MM-DD_hh:mm'), ('YYYY-MM-DD',)),
+  'sayepurge':  (('YYYY-MM-DD-hh:mm:ss',),),
+  'epoch':      (('EEEEEEEEEE',),),
+}
+
+# Values of decimal digit strings up to 4 digits, dict lookups are cheaper than int()
+digitvalues = { '%0*u' % (width, i): i for width in (1, 2, 3, 4) for i in range (10 ** width) }
+
+# Fixed width time stamp layout, compiled from a template
+class NameLayout:
+  def __init__ (self, template):
+    self.template = template
+    self.fields = []            # datetime field index per digit group, 6 for epoch seconds
+    self.values = [ 1, 1, 1, 12, 0, 0 ] # datetime defaults, date-only layouts default to noon
+    regex = ''
+    i = 0
+    while i < len (template):
+      c = template[i]
+      if c in 'YMDhmsE':
+        # one group per run of the same letter
+        j = i
+        while j < len (template) and template[j] == c:
+          j += 1
+        self.fields += [ 'YMDhmsE'.index (c) ]
+        regex += r'(\d{%u})' % (j - i)
+        i = j
+        continue
+      elif c == '_':
+        regex += r'[^\d]'
+      else:
+        regex += re.escape (c)
+      i += 1
+    self.regex = r'(?<!\d)' + regex + r'(?!\d)'
+    self.epoch = 6 in self.fields
+    # leading year, month, ... fields can be passed to datetime() in order
+    self.ordered = not self.epoch and self.fields == list (range (len (self.fields))) and \
+      all (len (run) <= 4 for run in re.findall (r'Y+|M+|D+|h+|m+|s+', template))
+    self.tail = tuple (self.values[len (self.fields):])
+    self.days = {}              # date digits -> datestamp() of midnight
+  def datetime (self, digits):
+    # Construct the datetime from the digit strings of all groups
+    if self.ordered:
+      return datetime.datetime (*map (digitvalues.__getitem__, digits), *self.tail)
+    if self.epoch:
+      return datetime.datetime.fromtimestamp (int (digits[self.fields.index (6)]))
+    values = self.values[:]
+    for field, v in zip (self.fields, digits):
+      values[field] = int (v)
+    return datetime.datetime (*values)
+  def stamp (self, digits):
+    # Integer seconds as datestamp() of datetime(), without constructing a datetime per name
+    if not self.ordered or len (self.fields) < 3:
+      return datestamp (self.datetime (digits))
+    date = digits[:3]
+    day = self.days.get (date)
+    if day is None:
+      day = self.days[date] = datetime.date (*map (int, date)).toordinal() * 86400
+    if len (digits) == 3:
+      return day + 12 * 3600
+    hour = digitvalues[digits[3]]
+    minute = digitvalues[digits[4]] if len (digits) > 4 else 0
+    second = digitvalues[digits[5]] if len (digits) > 5 else 0
+    if hour > 23 or minute > 59 or second > 59:
+      raise ValueError ('time out of range: ' + repr (digits))
+    return day + hour * 3600 + minute * 60 + second
+
+# Time stamp extractor for a list of named formats or templates
+class NameParser:
+  def __init__ (self, formats = ('compact',)):
+    self.formats = list (formats)
+    levels = []
+    for f in formats:
+      levels += nameformats[f] if f in nameformats else [ (f,) ]
+    # one regex per precedence level, alternatives of a level are tried at each position;
+    # the outer group of a layout closes last, so lastindex identifies the matching layout
+    self.levels = []            # (search, { outer group index: (NameLayout, digit group indices) })
+    for level in levels:
+      group, layouts = [], {}
+      for template in level:
+        layout = NameLayout (template)
+        n = 1 + sum (1 + len (l.fields) for l, g in layouts.values())
+        layouts[n] = (layout, tuple (range (n + 1, n + 1 + len (layout.fields))))
+        group += [ '(%s)' % layout.regex ]
+      self.levels += [ (re.compile ('|'.join (group)).search, layouts) ]
+  def split (self, name, stamp = False):
+    # Extract backup set prefix and date & time from a filename, as datestamp() integer if `stamp`
+    start = name.rfind ('/') + 1
+    bname = name[start:]
+    # ignore partial backups
+    if '.part' in bname or '.tmp' in bname or '.temp' in bname:
+      return name, None
+    for search, layouts in self.levels:
+      m = search (name, start)
+      if m:
+        layout, groups = layouts[m.lastindex]
+        digits = m.group (*groups) if len (groups) > 1 else (m.group (groups[0]),)
+        if stamp:
+          return name[:m.start (groups[0])], layout.stamp (digits)
+        return name[:m.start (groups[0])], layout.datetime (digits)
+    return name, None
+
+# Default time stamp extractor
+nameparser = NameParser()
+
+# Extract backup set prefix and date & time from a filename
+def namesplit (name, parser = None):
+  return (parser or nameparser).split (name)
+
 # Extract date & time from a filename
-def namedatetime (name):
-  bname = os.path.basename (name)
-  # ignore partial backups
-  ignores = ('.part', '.tmp', '.temp')
-  for pat in ignores:
-    if bname.find (pat) >= 0:
-      return None
-  # match 19991231T2359
-  digits = re.search (r'(?<!\d)(\d\d\d\d)(\d\d)(\d\d)[^\d]?(\d\d)(\d\d)(?!\d)', bname)
-  if digits:
-    yyyy, mm, dd, hh, ii = digits[1], digits[2], digits[3], digits[4], digits[5]
-    return datetime.datetime (int (yyyy), int (mm), int (dd), int (hh), int (ii))
-  # match 19991231
-  digits = re.search (r'(?<!\d)(\d\d\d\d)(\d\d)(\d\d)(?!\d)', bname)
-  if digits:
-    yyyy, mm, dd = digits[1], digits[2], digits[3]
-    return datetime.datetime (int (yyyy), int (mm), int (dd), 12, 0)
-  return None
+def namedatetime (name, parser = None):
+  return namesplit (name, parser)[1]
+
+# Helpers to convert datetime objects to and from integer seconds
+def datestamp (dtime):
+  return dtime.toordinal() * 86400 + dtime.hour * 3600 + dtime.minute * 60 + dtime.second
+def stampdate (stamp):
+  return datetime.datetime.min + datetime.timedelta (0, stamp - 86400)   # datetime.min has ordinal 1
 
 # Filename with datetime if any was recognized
 class Backup:
-  def __init__ (self, name):
+  def __init__ (self, name, parser = None, split = None):
     self.name = name
-    self.filetime = namedatetime (name)
+    self.prefix, self.filetime = split or namesplit (name, parser)
   def __repr__ (self):
     return 'Backup' + str ((self.filetime, self.name))
 
@@ -107,76 +210,119 @@ def subtract_month (dtime):
     next = dtime.replace (month = dtime.month - 1)
   return next
 
+# Helper to for year-=1 in a datetime object, None before datetime.MINYEAR
+def subtract_year (dtime):
+  if dtime.year <= datetime.MINYEAR:
+    return None
+  return dtime.replace (year = dtime.year - 1)
+
+# Series of descending slot bounds for one retention tier
+class SlotTier:
+  def __init__ (self, classification, first, count, step, slots):
+    self.classification = classification
+    self.slots = slots          # Slot list built for this tier
+    self.first = first          # most recent bound
+    self.count = count          # number of bounds is count + 1
+    self.step = step            # yields the next older bound
+  def bounds (self, oldest = None):
+    # Bounds older than `oldest` all select the same backup, so stop after the first of those
+    bound = self.first
+    for i in range (self.count + 1):
+      if bound is None:
+        break
+      yield bound
+      if oldest is not None and bound <= oldest:
+        break
+      bound = self.step (bound)
+  def __repr__ (self):
+    return 'SlotTier' + str ((self.classification._name_, self.first, self.count))
+
 # Sort backups into slots according to a retention policy
 class BackupCollector:
-  def __init__ (self, retention):
+  def __init__ (self, retention, now = None):
     # prepare slots
+    self.now = now or datetime.datetime.now()
     self.latestb = None
     self.hours = []
     self.days = []
     self.weeks = []
     self.months = []
     self.years = []
+    self.tiers = []
     self.retention = retention
     self.collection = set()
+    self.byfiletime = {}        # filetime -> first Backup fed with that filetime
+    self.classes = None         # name -> Classification, built on demand
     self.configure()
-  def add_to_slots (self, slotlist, backup):
-    for slot in slotlist:
-      if backup.filetime >= slot.bound and (not slot.backup or backup.filetime < slot.backup.filetime):
-        slot.backup = backup
-  def find_in_slots (self, slotlist, name):
-    for slot in slotlist:
-      if slot.backup and name == slot.backup.name:
-        return True
-    return False
   def configure (self):
-    dtime_now = datetime.datetime.now()
+    now = self.now
+    # slot tiers in order of classification precedence
     # hour slots
     if self.retention.hourly:
       bound = datetime.datetime (now.year, now.month, now.day, now.hour, 0)
-      for i in range (self.retention.hourly + 1):
-        self.hours += [ Slot (bound) ]
-        bound -= datetime.timedelta (hours = 1)
+      self.tiers += [ SlotTier (Classification.HOUR, bound, self.retention.hourly,
+                                lambda b: b - datetime.timedelta (hours = 1), self.hours) ]
     # day slots
     if self.retention.daily:
       bound = datetime.datetime (now.year, now.month, now.day, 0, 0)
-      for i in range (self.retention.daily + 1):
-        self.days += [ Slot (bound) ]
-        bound -= datetime.timedelta (days = 1)
+      self.tiers += [ SlotTier (Classification.DAY, bound, self.retention.daily,
+                                lambda b: b - datetime.timedelta (days = 1), self.days) ]
     # week slots
     if self.retention.weekly:
       dayofweek = self.retention.dayofweek
-      #bound = datetime.datetime (now.year, now.month, now.day - now.weekday() + dayofweek, 0, 0)
       bound = datetime.datetime (now.year, now.month, now.day, 0, 0)
       bound += datetime.timedelta (days = - now.weekday() + dayofweek)
       if dayofweek > now.weekday(): # shift date out of the future
         bound -= datetime.timedelta (days = 7)
-      for i in range (self.retention.weekly + 1):
-        self.weeks += [ Slot (bound) ]
-        bound = bound - datetime.timedelta (days = 7)
+      self.tiers += [ SlotTier (Classification.WEEK, bound, self.retention.weekly,
+                                lambda b: b - datetime.timedelta (days = 7), self.weeks) ]
     # month slots
     if self.retention.monthly:
       bound = datetime.datetime (now.year, now.month, 1, 0, 0)
-      for i in range (self.retention.monthly + 1):
-        self.months += [ Slot (bound) ]
-        bound = subtract_month (bound)
+      self.tiers += [ SlotTier (Classification.MONTH, bound, self.retention.monthly, subtract_month, self.months) ]
     # year slots
     if self.retention.yearly:
-      for i in range (self.retention.yearly + 1):
-        bound = datetime.datetime (now.year - i, 1, 1, 0, 0)
-        self.years += [ Slot (bound) ]
+      bound = datetime.datetime (now.year, 1, 1, 0, 0)
+      self.tiers += [ SlotTier (Classification.YEAR, bound, self.retention.yearly, subtract_year, self.years) ]
+  def build_slots (self):
+    # Each slot holds the oldest backup at or after its bound, found by bisecting the sorted filetimes.
+    # Slots are only built for bounds within the span of collected backups, empty slots are skipped.
+    times = sorted (self.byfiletime)
+    oldest = times[0] if times else None
+    newest = times[-1] if times else None
+    for tier in self.tiers:
+      slots = tier.slots
+      del slots[:]
+      if not times:
+        continue
+      for bound in tier.bounds (oldest):
+        if bound > newest:
+          continue
+        slot = Slot (bound)
+        slot.backup = self.byfiletime[times[bisect.bisect_left (times, bound)]]
+        slots += [ slot ]
+  def slotcounts (self):
+    # Number of slots built per tier
+    return { tier.classification._name_: len (tier.slots) for tier in self.tiers }
+  def build_classes (self):
+    self.build_slots()
+    classes = {}
+    if self.retention.latest and self.latestb:
+      classes[self.latestb.name] = Classification.LATEST
+    for tier in self.tiers:
+      for slot in tier.slots:
+        classes.setdefault (slot.backup.name, tier.classification)
+    self.classes = classes
   def feed (self, name):
-    b = Backup (name)
+    return self.feed_backup (Backup (name))
+  def feed_backup (self, b):
     if not b.filetime:
       return False
-    self.collection.add (name)
+    self.collection.add (b.name)
+    self.classes = None
     if not self.latestb or b.filetime > self.latestb.filetime:
       self.latestb = b
-    self.add_to_slots (self.hours, b)
-    self.add_to_slots (self.days, b)
-    self.add_to_slots (self.weeks, b)
-    self.add_to_slots (self.months, b)
-    self.add_to_slots (self.years, b)
+    self.byfiletime.setdefault (b.filetime, b)
     return True
   def collect (self, nlist):
     for name in nlist:
@@ -185,21 +331,199 @@ class BackupCollector:
     if self.retention.unknown:                          return Classification.UNKNOWN
     if not name in self.collection:                     return Classification.UNKNOWN
     if self.retention.all:                              return Classification.ALL
-    if self.retention.latest and \
-       self.latestb and self.latestb.name == name:      return Classification.LATEST
-    if self.find_in_slots (self.hours, name):           return Classification.HOUR
-    if self.find_in_slots (self.days, name):            return Classification.DAY
-    if self.find_in_slots (self.weeks, name):           return Classification.WEEK
-    if self.find_in_slots (self.months, name):          return Classification.MONTH
-    if self.find_in_slots (self.years, name):           return Classification.YEAR
+    if self.classes is None:
+      self.build_classes()
+    cls = self.classes.get (name)
+    if cls:                                             return cls
     if self.retention.none:                             return Classification.NONE
     else:                                               return Classification.DISCARD
 
+# Columnar BackupCollector, classifies arrays of time stamps with NumPy.
+# Names are parsed straight into datestamp() integers, without Backup or datetime objects.
+class BatchCollector (BackupCollector):
+  def __init__ (self, retention, now = None):
+    super().__init__ (retention, now)
+    self.names = []             # first occurrence of each collected name
+    self.stamps = array.array ('q')
+    self.collection = {}        # name -> index into names and stamps
+    self.rank = None
+  def feed (self, name):
+    return self.feed_stamp (name, nameparser.split (name, True)[1])
+  def feed_backup (self, b):
+    return self.feed_stamp (b.name, datestamp (b.filetime) if b.filetime else None)
+  def feed_stamp (self, name, stamp):
+    if stamp is None:
+      return False
+    if not name in self.collection:
+      self.collection[name] = len (self.names)
+      self.names.append (name)
+      self.stamps.append (stamp)
+      self.classes = None
+    return True
+  def build_ranks (self):
+    # Rank names by classification precedence: 0 for LATEST, 1 + tier index for slots
+    import numpy
+    stamps = numpy.frombuffer (self.stamps, dtype = numpy.int64) if self.stamps else numpy.zeros (0, numpy.int64)
+    rank = numpy.full (len (stamps), 1 + len (self.tiers), dtype = numpy.int8)
+    self.nslots = { tier.classification._name_: 0 for tier in self.tiers }
+    if len (stamps):
+      order = numpy.argsort (stamps, kind = 'stable')  # equal stamps keep feeding order
+      sstamps = stamps[order]
+      oldest, newest = stampdate (int (sstamps[0])), stampdate (int (sstamps[-1]))
+      for i, tier in enumerate (self.tiers):
+        bounds = [ datestamp (bound) for bound in tier.bounds (oldest) if bound <= newest ]
+        self.nslots[tier.classification._name_] = len (bounds)
+        if bounds:
+          # slots hold the first backup at or after their bound
+          chosen = order[numpy.searchsorted (sstamps, numpy.array (bounds, dtype = numpy.int64), 'left')]
+          numpy.minimum.at (rank, chosen, 1 + i)
+      if self.retention.latest:
+        rank[order[numpy.searchsorted (sstamps, sstamps[-1], 'left')]] = 0
+    self.rank = rank
+  def build_classes (self):
+    import numpy
+    self.build_ranks()
+    classes = [ Classification.LATEST ] + [ tier.classification for tier in self.tiers ]
+    self.classes = { self.names[i]: classes[self.rank[i]] for i in numpy.flatnonzero (self.rank < len (classes)) }
+  def slotcounts (self):
+    if self.rank is None:
+      self.build_ranks()
+    return self.nslots
+  def masks (self):
+    # Boolean keep and discard arrays, aligned with self.names
+    import numpy
+    if self.classes is None:
+      self.build_classes()
+    if self.retention.unknown:
+      keep = numpy.zeros (len (self.names), dtype = bool)
+      return keep, keep.copy()
+    if self.retention.all:
+      keep = numpy.ones (len (self.names), dtype = bool)
+    else:
+      keep = self.rank <= len (self.tiers)
+    return keep, ~keep
+
+# Use BatchCollector if NumPy is available, BackupCollector otherwise
+def batch_collector():
+  try:
+    import numpy
+  except ImportError:
+    return BackupCollector
+  return BatchCollector
+
+# Classify `names` according to `policy` (a Retention or retention string) at time `now`.
+# Returns a dict mapping each name to its Classification, in the order of `names`.
+def plan (names, policy, now = None, parser = None, collector = BackupCollector):
+  retention = policy if isinstance (policy, Retention) else Retention (policy)
+  collector = collector (retention, now)
+  names = list (names)
+  for name in names:
+    if isinstance (collector, BatchCollector):
+      collector.feed_stamp (name, (parser or nameparser).split (name, True)[1])
+    else:
+      collector.feed_backup (Backup (name, parser))
+  return { name: collector.classify (name) for name in names }
+
+# Even spread purging as in backups/sayepurge.sh: `backups` are (stamp, name) pairs sorted recent first,
+# the `guard` most recent are ignored, the last of those anchors the time deltas. Backups are purged until
+# `keep` remain (or `maxdelete` are purged), always picking the one with the smallest time delta to its
+# neighbours and protecting the oldest. Returns the lists of ignored, purged (in order) and kept names.
+def spread_purge (backups, keep, guard = 1, maxdelete = None):
+  import heapq
+  guard = max (1, guard)
+  ignored = [ name for stamp, name in backups[:guard] ]
+  items = backups[guard - 1:]   # items[0] is the anchor, candidates are items[1:]
+  count = len (items) - 1
+  if count < 1:
+    return ignored, [], []
+  # delta[i] is the distance to the more recent predecessor, linked through prev/succ
+  delta = [ 0 ] + [ items[i - 1][0] - items[i][0] for i in range (1, len (items)) ]
+  prev = list (range (-1, count))
+  succ = list (range (1, count + 1)) + [ None ]
+  alive = [ True ] * len (items)
+  heap = [ (delta[i], -i) for i in range (2, len (items)) ]    # last among equals pops first
+  heapq.heapify (heap)
+  ndeletions = count - keep
+  if maxdelete != None:
+    ndeletions = min (ndeletions, maxdelete)
+  purged = []
+  for j in range (ndeletions):
+    if count < 2:
+      m = succ[0]
+    else:
+      # find smallest delta, skipping stale entries and the first candidate
+      first = []
+      while True:
+        d, m = heap[0]
+        m = -m
+        if not alive[m] or delta[m] != d:
+          heapq.heappop (heap)
+        elif prev[m] == 0:
+          first.append (heapq.heappop (heap))
+        else:
+          break
+      for entry in first:
+        heapq.heappush (heap, entry)
+      # decide between m and its predecessor, protect oldest backup
+      if prev[m] != 0 and succ[m] != None:
+        if delta[prev[m]] < delta[succ[m]]:
+          m = prev[m]   # predecessor has closer neighbour
+      elif succ[m] == None:
+        m = prev[m]
+    # purge m, its successor inherits the time delta
+    alive[m] = False
+    purged.append (items[m][1])
+    p, s = prev[m], succ[m]
+    succ[p] = s
+    if s != None:
+      prev[s] = p
+      delta[s] += delta[m]
+      heapq.heappush (heap, (delta[s], -s))
+    count -= 1
+  kept = []
+  i = succ[0]
+  while i != None:
+    kept.append (items[i][1])
+    i = succ[i]
+  return ignored, purged, kept
+
 # Arguments
 usage0 = 'Usage: aging.py [Options] [pathnames...]'
 usage1 = '''
 Use the `--keep` or `--discard` arguments to filter a given set of
-`pathnames` according to a retention policy.
+`pathnames` according to a retention policy. Large sets of pathnames
+can be streamed via `--from-file` or `-0` from stdin.
+With `--scan`, each pathname is a backup root directory whose entries
+are listed and classified as a separate set of backups.
+A `--policy` file assigns retention policies to backup sets, each line
+holds a glob PATTERN followed by RETENTION. Pathnames matching PATTERN
+are grouped into sets by the name prefix preceding their time stamp,
+other pathnames use the RETENTION given for each option.
+For periodic runs over the same pathnames, `--state` keeps parsed time
+stamps between runs and `--watch` sessions, so only pathnames added
+since are parsed again.
+With `--watch`, pathnames are backup roots that are kept under watch,
+and pathnames are listed (or passed to `--hook`) as soon as `--discard`
+classifies them for deletion, after new backups land or as time passes.
+With `--space`, the `--discard` list is replaced by a report of the
+disk usage and the bytes freed per discarded pathname, where files
+hardlinked from kept pathnames (e.g. rsync --link-dest) are not freed.
+With `--time-from`, backups are dated by the first of the given sources
+that yields a time: `name` for time stamps in names, or the `mtime`,
+`ctime` or `birth` time of the file. Names dated by metadata are grouped
+into one set per directory. Birth times need a statx() call per file,
+`--stat-cache` keeps them in FILE while inode, mtime and ctime are unchanged.
+With `--delete`, discarded pathnames are renamed to `*.delete.tmp` and
+removed by `--jobs` workers, optionally paced by `--rate` and `--io-limit`.
+Pathnames are listed once deleted, with statistics on stderr.
+With `--stats=json`, wall and CPU seconds per phase, classification counts,
+unparsable names, slots per tier and peak memory are printed to stderr.
+Set AGING_PROFILE to a filename to write cProfile data, or to `-` for a
+summary on stderr.
+With `--spread`, backups older than the `--guard` most recent ones are
+purged until KEEP remain, always picking the backup with the shortest
+time distance to its neighbours and never the oldest. The listed Ignore,
+Purge and Keep decisions match those of backups/sayepurge.sh.
 OPTIONS:
 '''
 argdefs = (
@@ -207,6 +531,28 @@ argdefs = (
   ('-d', '--discard', '<RETENTION>', 'List all filenames to be discarded'),
   ('-k', '--keep',    '<RETENTION>', 'List all filenames to be kept'),
   ('-p', '--print',   '<RETENTION>', 'Print retention reason'),
+  ('-0', '--null',    '',            'Read and write NUL terminated pathnames'),
+  ('',   '--from-file', '<FILE>',    'Read pathnames from FILE, `-` for stdin'),
+  ('-s', '--scan',    '',            'Treat pathnames as backup roots to scan'),
+  ('-g', '--glob',    '<PATTERN>',   'Scan for backups matching PATTERN (`*`)'),
+  ('-j', '--jobs',    '<N>',         'Number of concurrent directory scans'),
+  ('-P', '--policy',  '<FILE>',      'Read per backup set retention from FILE'),
+  ('',   '--numpy',   '',            'Classify with NumPy arrays if available'),
+  ('-t', '--pattern', '<FORMAT>',    'Time stamp formats or templates, see below'),
+  ('',   '--time-from', '<SOURCES>', 'Time stamp sources: name,mtime,ctime,birth'),
+  ('',   '--stat-cache', '<FILE>',   'Cache birth times for --time-from in FILE'),
+  ('',   '--stats',   '<FORMAT>',      'Print phase timings and counts as `json` to stderr'),
+  ('',   '--state',   '<FILE>',      'Cache parsed time stamps in FILE'),
+  ('-w', '--watch',   '',            'Watch backup roots and report discards'),
+  ('',   '--hook',    '<COMMAND>',   'Run COMMAND with each discard when watching'),
+  ('',   '--interval', '<SECONDS>',  'Poll interval without inotify (10)'),
+  ('',   '--space',   '',            'Report disk usage and freed bytes of discards'),
+  ('',   '--delete',  '',            'Delete discarded pathnames in parallel'),
+  ('',   '--rate',    '<N>',         'Unlink at most N files per second'),
+  ('',   '--io-limit', '<BYTES>',    'Unlink at most BYTES of file data per second'),
+  ('',   '--spread',  '<KEEP>',        'Purge for an even time spread, keep KEEP'),
+  ('',   '--guard',   '<N>',           'Ignore N most recent backups for --spread (1)'),
+  ('',   '--max-delete', '<N>',        'Purge at most N backups for --spread'),
 )
 usage2 = '''
 RETENTION:
@@ -214,6 +560,12 @@ Specify retention filters in terms of year/month/week/day/hour file ages
 using a single letter postfix, and via the keywords `none`, `latest`, `all`.
 Multiple policies can be combined by using space as a separator. Detailed
 policy syntax: `no|<number>{y|m|w|d|h}|latest|all`
+FORMAT:
+A comma separated list of time stamp formats, tried in order. Named
+formats are `compact` (19991231T2359 or 19991231, the default), `iso`
+(1999-12-31T23:59:59), `sayepurge` (1999-12-31-23:59:59) and `epoch`
+(seconds). Templates use the letters YMDhms and E (epoch seconds) for
+digits, `_` for any non-digit and other characters literally.
 '''
 
 def usage (short = False):
@@ -237,55 +589,909 @@ def usage (short = False):
   if usage2:
     print (usage2.strip())
 
+# Parse the comma separated --time-from list
+def time_sources (string):
+  sources = [ source.strip() for source in string.split (',') if source.strip() ]
+  for source in sources:
+    if source != 'name' and not source in timesources:
+      raise getopt.GetoptError ('invalid time stamp source: ' + source)
+  return sources or [ 'name' ]
+
 def process_args (args):
   short_options, long_options = '', []
   for arg in argdefs:
     if arg[0]: short_options +=   arg[0].lstrip ('-') + (':' if arg[2] else '')
     if arg[1]: long_options  += [ arg[1].lstrip ('-') + ('=' if arg[2] else '') ]
   options, arguments = getopt.gnu_getopt (args, short_options, long_options)
-  config = { 'keep': None, 'discard': None, 'print': None }
+  config = { 'keep': None, 'discard': None, 'print': None, 'from-file': None, 'delimiter': b'\n',
+             'scan': False, 'glob': '*', 'jobs': 8, 'policies': [],
+             'collector': BackupCollector, 'parser': nameparser, 'state': None,
+             'time-from': [ 'name' ], 'stat-cache': None, 'stats': None,
+             'watch': False, 'hook': None, 'interval': 10.0,
+             'space': False, 'delete': False, 'rate': 0, 'io-limit': 0,
+             'spread': None, 'guard': 1, 'max-delete': None,
+             'now': datetime.datetime.now() }
   for k,v in options:
     if   k in ('-h', '--help'):         usage(); sys.exit (0)
     elif k in ('-k', '--keep'):         config['keep'] = v
     elif k in ('-d', '--discard'):      config['discard'] = v
     elif k in ('-p', '--print'):        config['print'] = v
+    elif k in ('-0', '--null'):         config['delimiter'] = b'\0'
+    elif k == '--from-file':            config['from-file'] = v
+    elif k in ('-s', '--scan'):         config['scan'] = True
+    elif k in ('-g', '--glob'):         config['glob'] = v
+    elif k in ('-j', '--jobs'):         config['jobs'] = max (1, int (v))
+    elif k in ('-P', '--policy'):       config['policies'] += read_policies (v)
+    elif k == '--numpy':                config['collector'] = batch_collector()
+    elif k in ('-t', '--pattern'):      config['parser'] = NameParser (v.split (','))
+    elif k == '--time-from':            config['time-from'] = time_sources (v)
+    elif k == '--stat-cache':           config['stat-cache'] = v
+    elif k == '--stats':
+      if v != 'json':
+        raise getopt.GetoptError ('unsupported stats format: ' + v)
+      config['stats'] = RunStats()
+    elif k == '--state':                config['state'] = v
+    elif k in ('-w', '--watch'):        config['watch'] = True
+    elif k == '--hook':                 config['hook'] = v
+    elif k == '--interval':             config['interval'] = max (0.1, float (v))
+    elif k == '--space':                config['space'] = True
+    elif k == '--delete':               config['delete'] = True
+    elif k == '--rate':                 config['rate'] = max (0, float (v))
+    elif k == '--io-limit':             config['io-limit'] = max (0, float (v))
+    elif k == '--spread':               config['spread'] = max (0, int (v))
+    elif k == '--guard':                config['guard'] = max (1, int (v))
+    elif k == '--max-delete':           config['max-delete'] = max (0, int (v))
   config['filenames'] = arguments
   return config
 
-# Arguments
-config = process_args (sys.argv[1:])
-
-# --keep
-if config['keep'] != None:
-  retention = Retention (config['keep'])
-  collector = BackupCollector (retention)
-  collector.collect (config['filenames'])
-  for name in sorted (config['filenames']):
-    cls = collector.classify (name)
-    if cls in (Classification.UNKNOWN, Classification.DISCARD, Classification.NONE):
+# Split a binary stream into names at `delimiter`, reading it in chunks
+def read_names (stream, delimiter = b'\n', chunksize = 1024 * 1024):
+  tail = b''
+  while True:
+    chunk = stream.read (chunksize)
+    if not chunk:
+      break
+    parts = (tail + chunk).split (delimiter)
+    tail = parts.pop()
+    for part in parts:
+      if part:
+        yield os.fsdecode (part)
+  if tail:
+    yield os.fsdecode (tail)
+
+# Generate pathnames from the command line and --from-file
+def input_names (config):
+  yield from config['filenames']
+  fromfile = config['from-file']
+  if fromfile is None and config['delimiter'] == b'\0':
+    fromfile = '-'
+  if fromfile == '-':
+    yield from read_names (sys.stdin.buffer, config['delimiter'])
+  elif fromfile is not None:
+    with open (fromfile, 'rb') as stream:
+      yield from read_names (stream, config['delimiter'])
+
+# Wall and CPU time per phase of a run and classification counters, reported by --stats
+class RunStats:
+  def __init__ (self):
+    self.phases = {}            # phase -> [ wall seconds, CPU seconds ]
+    self.counts = {}            # mode -> { Classification name -> count }
+    self.names = 0
+    self.unparsable = 0
+    self.slots = {}             # retention -> { tier -> number of slots }
+  def add (self, phase, wall, cpu):
+    times = self.phases.setdefault (phase, [ 0.0, 0.0 ])
+    times[0] += wall
+    times[1] += cpu
+  def count (self, mode, cls):
+    counts = self.counts.setdefault (mode, {})
+    counts[cls._name_] = counts.get (cls._name_, 0) + 1
+  def count_slots (self, collector):
+    slots = self.slots.setdefault (str (collector.retention), {})
+    for tier, n in collector.slotcounts().items():
+      slots[tier] = slots.get (tier, 0) + n
+  def report (self, stream):
+    import json, resource
+    maxrss = resource.getrusage (resource.RUSAGE_SELF).ru_maxrss
+    json.dump ({ 'phases': { phase: { 'wall': round (wall, 6), 'cpu': round (cpu, 6) }
+                             for phase, (wall, cpu) in self.phases.items() },
+                 'names': self.names, 'unparsable': self.unparsable,
+                 'classifications': self.counts, 'slots': self.slots,
+                 'peak_rss': maxrss * (1 if sys.platform == 'darwin' else 1024) }, stream, sort_keys = True)
+    stream.write ('\n')
+
+# Account the enclosed code as `name` in the --stats phases
+class PhaseTimer:
+  def __init__ (self, config, name):
+    self.stats = config['stats']
+    self.name = name
+  def __enter__ (self):
+    if self.stats:
+      self.wall, self.cpu = time.perf_counter(), time.process_time()
+  def __exit__ (self, *exc):
+    if self.stats:
+      self.stats.add (self.name, time.perf_counter() - self.wall, time.process_time() - self.cpu)
+
+# Write an output record, terminated by the input delimiter
+def emit (config, record):
+  sys.stdout.buffer.write (os.fsencode (record) + config['delimiter'])
+
+# List directory entries of `root` that match `pattern`, sorted
+def scan_names (root, pattern):
+  names = []
+  with os.scandir (root) as it:
+    for entry in it:
+      if fnmatch.fnmatchcase (entry.name, pattern):
+        names.append (os.path.join (root, entry.name))
+  names.sort()
+  return names
+
+# Birth time of `path` from os.stat() or Linux statx(2) through libc, None if unsupported
+def birthtime (path, st):
+  if hasattr (st, 'st_birthtime'):
+    return st.st_birthtime
+  global libc_statx
+  if libc_statx is False:
+    import ctypes, ctypes.util
+    libc = ctypes.CDLL (ctypes.util.find_library ('c'), use_errno = True)
+    libc_statx = getattr (libc, 'statx', None)
+  if not libc_statx:
+    return None
+  import ctypes, struct
+  buf = ctypes.create_string_buffer (256)      # struct statx
+  AT_FDCWD, AT_SYMLINK_NOFOLLOW, STATX_BTIME = -100, 0x100, 0x800
+  if libc_statx (AT_FDCWD, os.fsencode (path), AT_SYMLINK_NOFOLLOW, STATX_BTIME, buf) != 0:
+    return None
+  mask, = struct.unpack_from ('I', buf, 0)
+  if not mask & STATX_BTIME:
+    return None
+  seconds, nanoseconds = struct.unpack_from ('qI', buf, 80)  # stx_btime
+  return seconds + nanoseconds * 1e-9
+libc_statx = False
+
+# Stat `paths`, returns a [st_ino, mtime, ctime, birthtime] list per path, None for unstatable paths.
+# Birth times from `cache` (directory -> basename -> list) entries with unchanged inode, mtime and ctime are reused.
+def stat_times (paths, birth = False, cache = None):
+  cache = cache or {}
+  results = []
+  for path in paths:
+    try:
+      st = os.stat (path, follow_symlinks = False)
+    except OSError:
+      results.append (None)
       continue
-    print (name)
-
-# --discard
-if config['discard'] != None:
-  retention = Retention (config['discard'])
-  collector = BackupCollector (retention)
-  collector.collect (config['filenames'])
-  for name in sorted (config['filenames']):
-    cls = collector.classify (name)
-    if cls in (Classification.DISCARD, Classification.NONE):
-      print (name)
-
-# --print
-if config['print'] != None:
-  retention = Retention (config['print'])
-  collector = BackupCollector (retention)
-  collector.collect (config['filenames'])
-  print ('%-15s' % 'Retaining:', str (retention))
-  for name in sorted (config['filenames']):
-    cls = collector.classify (name)
-    print ('%-15s' % (('first of ' if cls._value_[1] else '') + cls._name_), name)
-
-# fallback
-if not config['keep'] and not config['discard'] and not config['print']:
-  usage (short = True)
+    times = [ st.st_ino, st.st_mtime, st.st_ctime ]
+    directory, basename = os.path.split (path)
+    entry = cache.get (directory, {}).get (basename)
+    if not birth:
+      results.append (times + [ None ])
+    elif entry and entry[:3] == times and entry[3] is not None:
+      results.append (entry)
+    else:
+      results.append (times + [ birthtime (path, st) ])
+  return results
+
+# Time stamp sources besides names (--time-from), indices into stat_times() lists
+timesources = { 'mtime': 1, 'ctime': 2, 'birth': 3 }
+
+# Determine (prefix, datetime) splits for `names` from the --time-from sources, tried in order.
+# Metadata is stat()-ed on a thread pool in batches. If birth times are needed, --stat-cache keeps them
+# per directory entry, and entries with unchanged inode, mtime and ctime are reused without statx().
+# Names whose split depends on metadata are added to the set `metadated` if given.
+def time_splits (config, names, batchsize = 64, metadated = None):
+  import concurrent.futures
+  sources = config['time-from']
+  splits, pending = {}, []
+  for name in names:
+    for source in sources:
+      if source != 'name':
+        pending.append (name)
+        break
+      split = namesplit (name, config['parser'])
+      if split[1]:
+        splits[name] = split
+        break
+    else:
+      splits[name] = (name, None)
+  if not pending:
+    return splits
+  if metadated is not None:
+    metadated.update (pending)
+  birth = 'birth' in sources
+  cachefile = config['stat-cache'] if birth else None
+  cache = {}
+  if cachefile:
+    import json
+    try:
+      with open (cachefile) as f:
+        cache = json.load (f)
+    except (OSError, ValueError):
+      cache = {}
+  metadata = {}
+  with concurrent.futures.ThreadPoolExecutor (max_workers = config['jobs']) as executor:
+    batches = [ pending[i : i + batchsize] for i in range (0, len (pending), batchsize) ]
+    for batch, results in zip (batches, executor.map (stat_times, batches, [ birth ] * len (batches),
+                                                      [ cache ] * len (batches))):
+      metadata.update (zip (batch, results))
+  if cachefile:
+    bydir = {}
+    for name in pending:
+      if metadata[name]:
+        bydir.setdefault (os.path.dirname (name), {})[os.path.basename (name)] = metadata[name]
+    cache.update (bydir)
+    tmpname = cachefile + '.tmp%u' % os.getpid()
+    with open (tmpname, 'w') as f:
+      f.write (json.dumps (cache, separators = (',', ':')))
+    os.replace (tmpname, cachefile)
+  for name in pending:
+    split = (name, None)
+    for source in sources:
+      if source == 'name':
+        split = namesplit (name, config['parser'])
+      elif metadata[name] and metadata[name][timesources[source]] is not None:
+        # backups without a time stamp in their name form one set per directory
+        split = (os.path.join (os.path.dirname (name), ''),
+                 datetime.datetime.fromtimestamp (int (metadata[name][timesources[source]])))
+      if split[1]:
+        break
+    splits[name] = split
+  return splits
+
+# Compact set of (st_dev, st_ino) pairs, kept as bitmap pages of 4096 inode numbers
+class InodeSet:
+  def __init__ (self):
+    self.pages = {}
+  def add (self, dev, ino):
+    # Add an inode, returns False if it was present already
+    page = self.pages.get ((dev, ino >> 12))
+    if page is None:
+      page = self.pages[(dev, ino >> 12)] = bytearray (512)
+    i, bit = (ino & 4095) >> 3, 1 << (ino & 7)
+    if page[i] & bit:
+      return False
+    page[i] |= bit
+    return True
+  def __contains__ (self, devino):
+    dev, ino = devino
+    page = self.pages.get ((dev, ino >> 12))
+    return page is not None and bool (page[(ino & 4095) >> 3] & (1 << (ino & 7)))
+
+# List a directory as (st_dev, st_ino, st_nlink, bytes) records plus its subdirectories,
+# directories are recorded with st_nlink=1 since they cannot be hardlinked
+def scan_inodes (path):
+  records, subdirs = [], []
+  try:
+    with os.scandir (path) as it:
+      for entry in it:
+        try:
+          st = entry.stat (follow_symlinks = False)
+          isdir = entry.is_dir (follow_symlinks = False)
+        except OSError:
+          continue
+        records.append ((st.st_dev, st.st_ino, 1 if isdir else st.st_nlink, st.st_blocks * 512))
+        if isdir:
+          subdirs.append (entry.path)
+  except OSError as ex:
+    print ('aging.py: %s: %s' % (path, ex.strerror), file = sys.stderr)
+  return records, subdirs
+
+# Walk the tree at `root`, scanning directories on `executor`, yield the records of each directory.
+# Nothing is yielded if `root` cannot be stat()-ed, the error is reported like in scan_inodes().
+def walk_inodes (root, executor):
+  import concurrent.futures
+  try:
+    st = os.lstat (root)
+  except OSError as ex:
+    print ('aging.py: %s: %s' % (root, ex.strerror), file = sys.stderr)
+    return
+  isdir = os.path.isdir (root) and not os.path.islink (root)
+  yield [ (st.st_dev, st.st_ino, 1 if isdir else st.st_nlink, st.st_blocks * 512) ]
+  pending = { executor.submit (scan_inodes, root) } if isdir else set()
+  while pending:
+    done, pending = concurrent.futures.wait (pending, return_when = concurrent.futures.FIRST_COMPLETED)
+    for future in done:
+      records, subdirs = future.result()
+      pending |= { executor.submit (scan_inodes, path) for path in subdirs }
+      yield records
+
+# Report disk usage of `discards` and the bytes only they hold (--space). Data of an inode counts as freed
+# once all its st_nlink links were seen in discarded trees and none in kept ones, it is credited to the
+# discard holding the last link. Only inodes with several links are remembered, link counts only until complete.
+def space_report (config, discards, kept):
+  import concurrent.futures
+  keptinodes = InodeSet()
+  keptbytes = 0
+  links = {}                    # (st_dev, st_ino) -> links seen in discarded trees, while fewer than st_nlink
+  totalsize, totalfreed = 0, 0
+  with concurrent.futures.ThreadPoolExecutor (max_workers = config['jobs']) as executor:
+    for name in kept:
+      for records in walk_inodes (name, executor):
+        for dev, ino, nlink, nbytes in records:
+          if nlink == 1 or keptinodes.add (dev, ino):
+            keptbytes += nbytes
+    emit (config, '%15u %15s  %s' % (keptbytes, '-', 'kept (%u)' % len (kept)))
+    for name in discards:
+      local = InodeSet()        # count hardlinks within one tree once
+      size, freed = 0, 0
+      walked = False            # trees that cannot be stat()-ed are reported and skipped
+      for records in walk_inodes (name, executor):
+        walked = True
+        for dev, ino, nlink, nbytes in records:
+          if nlink == 1:
+            size += nbytes
+            freed += nbytes
+          else:
+            if local.add (dev, ino):
+              size += nbytes
+            if (dev, ino) in keptinodes:
+              continue
+            seen = links.pop ((dev, ino), 0) + 1
+            if seen == nlink:
+              freed += nbytes
+            else:
+              links[(dev, ino)] = seen
+      if not walked:
+        continue
+      emit (config, '%15u %15u  %s' % (size, freed, name))
+      sys.stdout.flush()
+      totalsize += size
+      totalfreed += freed
+  emit (config, '%15u %15u  %s' % (totalsize, totalfreed, 'discarded (%u)' % len (discards)))
+
+# Pacing shared by deletion workers, allows `rate` units per second (unlimited if 0)
+class RateLimit:
+  def __init__ (self, rate):
+    import threading
+    self.rate = rate
+    self.lock = threading.Lock()
+    self.due = time.monotonic()
+  def take (self, amount = 1):
+    if not self.rate or not amount:
+      return
+    with self.lock:
+      now = time.monotonic()
+      self.due = max (self.due, now - 1.0) + amount / self.rate  # at most one second of burst
+      delay = self.due - now
+    if delay > 0:
+      time.sleep (delay)
+
+# Counters of a --delete run
+class DeleteStats:
+  def __init__ (self):
+    import threading
+    self.lock = threading.Lock()
+    self.start = time.monotonic()
+    self.files, self.dirs, self.bytes, self.errors = 0, 0, 0, 0
+  def add (self, files = 0, dirs = 0, nbytes = 0, errors = 0):
+    with self.lock:
+      self.files += files
+      self.dirs += dirs
+      self.bytes += nbytes
+      self.errors += errors
+  def __str__ (self):
+    elapsed = max (1e-6, time.monotonic() - self.start)
+    s = 'deleted %u files and %u directories' % (self.files, self.dirs)
+    if self.bytes:
+      s += ', %.1f MB' % (self.bytes / 1e6)
+    s += ' in %.1fs, %.0f files/s' % (elapsed, self.files / elapsed)
+    if self.bytes:
+      s += ', %.1f MB/s' % (self.bytes / 1e6 / elapsed)
+    if self.errors:
+      s += ', %u errors' % self.errors
+    return s
+
+# Retry `func (path)` once after making `directory` writable, as in `chmod -R +rwX`
+def with_permission (func, path, directory):
+  try:
+    return func (path)
+  except PermissionError:
+    os.chmod (directory, 0o700)
+    return func (path)
+
+# Unlink all non-directories in `path`, returns its subdirectories
+def unlink_entries (path, config, stats):
+  try:
+    entries = with_permission (lambda p: list (os.scandir (p)), path, path)
+  except OSError as ex:
+    print ('aging.py: %s: %s' % (path, ex.strerror), file = sys.stderr)
+    stats.add (errors = 1)
+    return []
+  subdirs = []
+  files, nbytes, errors = 0, 0, 0
+  for entry in entries:
+    try:
+      if entry.is_dir (follow_symlinks = False):
+        subdirs.append (entry.path)
+        continue
+      size = entry.stat (follow_symlinks = False).st_blocks * 512 if config['io-limit'] else 0
+      config['ratelimit'].take()
+      config['iolimit'].take (size)
+      with_permission (os.unlink, entry.path, path)
+      files += 1
+      nbytes += size
+    except OSError as ex:
+      print ('aging.py: %s: %s' % (entry.path, ex.strerror), file = sys.stderr)
+      errors += 1
+  stats.add (files, 0, nbytes, errors)
+  return subdirs
+
+# Move `name` out of the way under a `.tmp` name that namesplit() ignores, so partial deletions are never backups
+def trash_name (name):
+  name = name.rstrip ('/') or name
+  trash = name + '.delete.tmp'
+  i = 0
+  while os.path.lexists (trash):
+    i += 1
+    trash = name + '.%u.delete.tmp' % i
+  os.rename (name, trash)
+  return trash
+
+# Delete the trees `names` (--delete) with a pool of workers, emit each pathname once it is gone.
+# Returns the number of errors.
+def delete_trees (config, names):
+  import concurrent.futures
+  stats = DeleteStats()
+  config.setdefault ('ratelimit', RateLimit (config['rate']))
+  config.setdefault ('iolimit', RateLimit (config['io-limit']))
+  progress = sys.stderr.isatty()
+  parents = {}                  # directory -> (parent directory or None, pathname of tree)
+  remaining = {}                # directory -> number of subdirectories not yet removed
+  failed = set()                # directories left with undeletable contents
+  def finish (path):
+    # remove empty directories bottom up, emit the tree name once its root is removed
+    while path:
+      parent, name = parents.pop (path)
+      ok = not path in failed
+      failed.discard (path)
+      if ok:
+        try:
+          # only directories within the trash tree are made writable, never the backup root
+          if parent is None:
+            os.rmdir (path)
+          else:
+            with_permission (os.rmdir, path, parent)
+          stats.add (dirs = 1)
+        except OSError as ex:
+          print ('aging.py: %s: %s' % (path, ex.strerror), file = sys.stderr)
+          stats.add (errors = 1)
+          ok = False
+      if parent is None:
+        if ok:
+          emit (config, name)
+          sys.stdout.flush()
+        return
+      if not ok:
+        failed.add (parent)
+      remaining[parent] -= 1
+      if remaining[parent]:
+        return
+      del remaining[parent]
+      path = parent
+  with concurrent.futures.ThreadPoolExecutor (max_workers = config['jobs']) as executor:
+    pending = {}
+    for name in names:
+      try:
+        trash = trash_name (name)
+      except OSError as ex:
+        print ('aging.py: %s: %s' % (name, ex.strerror), file = sys.stderr)
+        stats.add (errors = 1)
+        continue
+      if os.path.isdir (trash) and not os.path.islink (trash):
+        parents[trash] = (None, name)
+        pending[executor.submit (unlink_entries, trash, config, stats)] = trash
+      else:
+        try:
+          os.unlink (trash)
+          stats.add (files = 1)
+          emit (config, name)
+        except OSError as ex:
+          print ('aging.py: %s: %s' % (trash, ex.strerror), file = sys.stderr)
+          stats.add (errors = 1)
+    while pending:
+      done, notdone = concurrent.futures.wait (pending, timeout = 1.0, return_when = concurrent.futures.FIRST_COMPLETED)
+      for future in done:
+        path = pending.pop (future)
+        subdirs = future.result()
+        if not subdirs:
+          finish (path)
+          continue
+        remaining[path] = len (subdirs)
+        for subdir in subdirs:
+          parents[subdir] = (path, None)
+          pending[executor.submit (unlink_entries, subdir, config, stats)] = subdir
+      if progress:
+        print ('\raging.py: %s' % stats, end = '', file = sys.stderr, flush = True)
+  sys.stdout.flush()
+  print (('\r' if progress else '') + 'aging.py: %s' % stats, file = sys.stderr)
+  return stats.errors
+
+# Read policy file lines: `PATTERN RETENTION...`
+def read_policies (filename):
+  policies = []
+  with open (filename) as f:
+    for line in f:
+      words = line.split (None, 1)
+      if not words or words[0].startswith ('#'):
+        continue
+      policies.append ((words[0], words[1].strip() if len (words) > 1 else ''))
+  return policies
+
+# Collectors for one backup set, modes with equal retention share a collector
+class BackupSet:
+  def __init__ (self, retentions, collector = BackupCollector, now = None):
+    self.retentions = retentions # mode -> retention string
+    self.collectors = {}
+    bystring = {}
+    for mode, string in retentions.items():
+      if not string in bystring:
+        bystring[string] = collector (Retention (string), now)
+      self.collectors[mode] = bystring[string]
+    self.distinct = list (bystring.values())
+  def feed_backup (self, backup):
+    for collector in self.distinct:
+      collector.feed_backup (backup)
+  def feed_stamp (self, name, stamp):
+    for collector in self.distinct:
+      collector.feed_stamp (name, stamp)
+
+# Load the --state file, a JSON object with the names, prefix lengths and time stamps per set of pathnames
+def load_state (config):
+  import json
+  state = { 'pattern': config['parser'].formats, 'time-from': config['time-from'], 'roots': {} }
+  try:
+    with open (config['state']) as f:
+      previous = json.load (f)
+  except (OSError, ValueError):
+    return state
+  if previous.get ('pattern') == state['pattern'] and previous.get ('time-from', [ 'name' ]) == state['time-from']:
+    state['roots'] = { root: names for root, names in previous.get ('roots', {}).items() if 'stamps' in names }
+  return state
+
+# Atomically replace the --state file
+def save_state (config):
+  import json
+  tmpname = config['state'] + '.tmp%u' % os.getpid()
+  with open (tmpname, 'w') as f:
+    f.write (json.dumps (config['statedata'], separators = (',', ':')))   # json.dump() encodes in Python
+  os.replace (tmpname, config['state'])
+
+# Find the backup set key for a name, adding a BackupSet for new keys
+def backup_set_key (config, sets, modes, name, prefix, filetime):
+  if filetime:
+    for pattern, string in config['policies']:
+      if fnmatch.fnmatchcase (name, pattern):
+        key = (pattern, prefix)
+        if not key in sets:
+          sets[key] = BackupSet ({ mode: string for mode in modes }, config['collector'], config['now'])
+        return key
+  return None
+
+# Parse names and group them into backup sets with collectors for `modes`.
+# If a `state` of a previous run is given, names listed there are not parsed again,
+# and the prefix length and time stamp of every name are stored in `state` for the next run.
+def collect_sets (config, nameiter, modes, state = None):
+  stats = config['stats']
+  # parse each name once; with a policy file, names are grouped by matching pattern and set prefix
+  sets = { None: BackupSet ({ mode: config[mode] for mode in modes }, config['collector'], config['now']) }
+  names = []
+  # BatchCollector is fed time stamps parsed straight into integers, without Backup objects
+  batch = issubclass (config['collector'], BatchCollector)
+  known = dict (zip (state['names'], zip (state['prefixes'], state['stamps']))) if state else {}
+  splits = {}
+  metadated = set()             # names dated by file metadata, never kept in the state
+  if config['time-from'] != [ 'name' ]:
+    nameiter = list (nameiter)
+    splits = time_splits (config, [ name for name in nameiter if not name in known ], metadated = metadated)
+  parsed = { 'names': [], 'prefixes': [], 'stamps': [] }
+  for name in nameiter:
+    # filetime is a datetime, or a datestamp() integer for batch collectors
+    split = known.get (name)
+    if split:
+      prefix, stamp = name[:split[0]], split[1]
+      filetime = stamp if batch or stamp is None else stampdate (stamp)
+    else:
+      prefix, filetime = splits.get (name) or config['parser'].split (name, batch)
+      if batch and filetime and name in splits:
+        filetime = datestamp (filetime)
+      stamp = filetime if batch or not filetime or state is None else datestamp (filetime)
+    key = backup_set_key (config, sets, modes, name, prefix, filetime)
+    if batch:
+      sets[key].feed_stamp (name, filetime)
+    else:
+      sets[key].feed_backup (Backup (name, split = (prefix, filetime)))
+    names.append ((name, key))
+    if state is not None and not name in metadated:
+      parsed['names'].append (name)
+      parsed['prefixes'].append (len (prefix))
+      parsed['stamps'].append (stamp)
+    if stats:
+      stats.names += 1
+      stats.unparsable += filetime is None
+  names.sort()
+  if state is not None:
+    state.clear()
+    state.update (parsed)
+  return names, sets
+
+# Classify one set of pathnames and write all requested outputs, returns the number of --delete errors
+def process_set (config, nameiter, root = ''):
+  modes = [ mode for mode in ('keep', 'discard', 'print') if config[mode] != None ]
+  # with --state, names parsed by a previous run are reused
+  state = config['statedata']['roots'].pop (root, {}) if config['state'] else None
+  stats = config['stats']
+  with PhaseTimer (config, 'parse'):
+    names, sets = collect_sets (config, nameiter, modes, state)
+  if stats:
+    with PhaseTimer (config, 'slots'):
+      for backupset in sets.values():
+        for collector in backupset.distinct:
+          collector.build_classes()
+          stats.count_slots (collector)
+  # classify each name once per distinct retention, collecting all outputs in one pass
+  with PhaseTimer (config, 'classify'):
+    output = { mode: [] for mode in modes }
+    kept = []                   # pathnames retained by --discard, for --space
+    if config['print'] != None:
+      lastprint = config['print']
+      output['print'].append ('%-15s' % 'Retaining:' + ' ' + str (Retention (lastprint)))
+    for name, key in names:
+      backupset = sets[key]
+      # --keep
+      if config['keep'] != None:
+        cls = backupset.collectors['keep'].classify (name)
+        if stats:
+          stats.count ('keep', cls)
+        if not cls in (Classification.UNKNOWN, Classification.DISCARD, Classification.NONE):
+          output['keep'].append (name)
+      # --discard
+      if config['discard'] != None:
+        cls = backupset.collectors['discard'].classify (name)
+        if stats:
+          stats.count ('discard', cls)
+        if cls in (Classification.DISCARD, Classification.NONE):
+          output['discard'].append (name)
+        elif config['space'] and cls != Classification.UNKNOWN:
+          kept.append (name)
+      # --print
+      if config['print'] != None:
+        collector = backupset.collectors['print']
+        cls = collector.classify (name)
+        if stats:
+          stats.count ('print', cls)
+        if backupset.retentions['print'] != lastprint and cls != Classification.UNKNOWN:
+          lastprint = backupset.retentions['print']
+          output['print'].append ('%-15s' % 'Retaining:' + ' ' + str (collector.retention))
+        output['print'].append ('%-15s' % (('first of ' if cls._value_[1] else '') + cls._name_) + ' ' + name)
+  errors = 0
+  for mode in modes:
+    if mode == 'discard' and (config['space'] or config['delete']):
+      if config['space']:
+        with PhaseTimer (config, 'space'):
+          space_report (config, output[mode], kept)
+      if config['delete']:
+        with PhaseTimer (config, 'delete'):
+          errors += delete_trees (config, output[mode])
+      continue
+    with PhaseTimer (config, 'output'):
+      for record in output[mode]:
+        emit (config, record)
+  sys.stdout.flush()
+  if state is not None:
+    config['statedata']['roots'][root] = state
+  return errors
+
+# Purge pathnames for an even spread over time (--spread), messages match backups/sayepurge.sh
+def process_spread (config, nameiter, root = ''):
+  backups = []
+  splits = {}
+  if config['time-from'] != [ 'name' ]:
+    nameiter = list (nameiter)
+    splits = time_splits (config, nameiter)
+  with PhaseTimer (config, 'parse'):
+    for name in nameiter:
+      b = Backup (name, config['parser'], splits.get (name))
+      if b.filetime:
+        backups.append ((int (b.filetime.timestamp()), name))  # local time, like date(1)
+      if config['stats']:
+        config['stats'].names += 1
+        config['stats'].unparsable += not b.filetime
+  with PhaseTimer (config, 'spread'):
+    backups.sort (reverse = True)
+    ignored, purged, kept = spread_purge (backups, config['spread'], config['guard'], config['max-delete'])
+  for name in ignored:
+    emit (config, 'Ignore: ' + name)
+  for name in purged:
+    emit (config, 'Purge:  ' + name)
+  for name in kept:
+    emit (config, 'Keep:   ' + name)
+  sys.stdout.flush()
+
+# Scan backup roots concurrently, each root is processed as a separate set once its scan completes.
+# Roots that cannot be scanned are reported and skipped, returns the number of those plus the
+# errors returned by `process`.
+def process_roots (config, roots, process = process_set):
+  import concurrent.futures
+  errors = 0
+  with concurrent.futures.ThreadPoolExecutor (max_workers = config['jobs']) as executor:
+    futures = { executor.submit (scan_names, root, config['glob']): root for root in roots }
+    for future in concurrent.futures.as_completed (futures):
+      root = futures[future]
+      try:
+        names = future.result()
+      except OSError as ex:
+        print ('aging.py: %s: %s' % (root, ex.strerror), file = sys.stderr)
+        errors += 1
+        continue
+      errors += process (config, names, root) or 0
+  return errors
+
+# Directory change notification with inotify(7) through libc
+class InotifyWatcher:
+  IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x40, 0x80, 0x100, 0x200
+  def __init__ (self, roots):
+    import ctypes, ctypes.util
+    libc = ctypes.CDLL (ctypes.util.find_library ('c'), use_errno = True)
+    self.fd = libc.inotify_init1 (os.O_NONBLOCK | os.O_CLOEXEC)
+    if self.fd < 0:
+      raise OSError (ctypes.get_errno(), 'inotify_init1 failed')
+    self.roots = {}             # watch descriptor -> root
+    mask = self.IN_MOVED_FROM | self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE
+    for root in roots:
+      wd = libc.inotify_add_watch (self.fd, os.fsencode (root), mask)
+      if wd < 0:
+        err = ctypes.get_errno()
+        os.close (self.fd)
+        raise OSError (err, os.strerror (err), root)
+      self.roots[wd] = root
+  def wait (self, timeout):
+    # Return the roots with entries created, deleted or renamed within `timeout` seconds
+    import select, struct
+    changed = set()
+    if select.select ([ self.fd ], [], [], timeout)[0]:
+      while True:
+        try:
+          data = os.read (self.fd, 65536)
+        except BlockingIOError:
+          break
+        offset = 0
+        while offset + 16 <= len (data):
+          wd, mask, cookie, length = struct.unpack_from ('iIII', data, offset)
+          offset += 16 + length
+          if wd in self.roots:
+            changed.add (self.roots[wd])
+    return changed
+
+# Directory change detection by polling directory mtimes
+class PollWatcher:
+  def __init__ (self, roots, interval):
+    self.interval = interval
+    self.stamps = { root: self.stamp (root) for root in roots }
+  def stamp (self, root):
+    try:
+      st = os.stat (root)
+    except OSError:
+      return None
+    return (st.st_mtime_ns, st.st_ctime_ns, st.st_nlink)
+  def wait (self, timeout):
+    # Return the roots whose directory changed within `timeout` seconds
+    deadline = time.monotonic() + timeout
+    while True:
+      changed = set()
+      for root, stamp in self.stamps.items():
+        current = self.stamp (root)
+        if current != stamp:
+          self.stamps[root] = current
+          changed.add (root)
+      remaining = deadline - time.monotonic()
+      if changed or remaining <= 0:
+        return changed
+      time.sleep (min (self.interval, remaining))
+
+# Emit a discard event, optionally running the --hook command with the pathname
+def emit_discard (config, name):
+  if config['delete']:
+    delete_trees (config, [ name ])
+  else:
+    emit (config, name)
+  sys.stdout.flush()
+  if config['hook']:
+    import shlex, subprocess
+    status = subprocess.call (shlex.split (config['hook']) + [ name ])
+    if status != 0:
+      print ('aging.py: hook exited with status %d: %s' % (status, name), file = sys.stderr)
+
+# Watch backup roots and emit pathnames as soon as they are to be discarded
+def watch_roots (config, roots):
+  roots = list (roots)
+  try:
+    watcher = InotifyWatcher (roots)
+  except (OSError, AttributeError, TypeError):
+    watcher = PollWatcher (roots, config['interval'])
+  # collect_sets() state per root, kept in the --state file if given
+  states = config['statedata']['roots'] if config['state'] else {}
+  emitted = { root: set() for root in roots }
+  changed = set (roots)
+  hour = None
+  while True:
+    now = config['now'] = datetime.datetime.now()
+    # slot bounds only move at full hours, then every root needs re-evaluation
+    if hour != now.replace (minute = 0, second = 0, microsecond = 0):
+      hour = now.replace (minute = 0, second = 0, microsecond = 0)
+      changed = set (roots)
+    for root in roots:
+      if not root in changed:
+        continue
+      try:
+        names = scan_names (root, config['glob'])
+      except OSError as ex:
+        print ('aging.py: %s: %s' % (root, ex.strerror), file = sys.stderr)
+        names = []
+      names, sets = collect_sets (config, names, [ 'discard' ], states.setdefault (root, {}))
+      discards = set()
+      for name, key in names:
+        if sets[key].collectors['discard'].classify (name) in (Classification.DISCARD, Classification.NONE):
+          discards.add (name)
+          if not name in emitted[root]:
+            emit_discard (config, name)
+      emitted[root] = discards
+    if config['state'] and changed:
+      save_state (config)
+    timeout = (hour + datetime.timedelta (hours = 1) - datetime.datetime.now()).total_seconds()
+    changed = watcher.wait (max (0.0, timeout) + 0.01)
+
+# Process pathnames or backup roots according to command line arguments
+def main (argv):
+  wall, cpu = time.perf_counter(), time.process_time()
+  config = process_args (argv[1:])
+  status = 0
+  if config['stats']:
+    config['stats'].add ('args', time.perf_counter() - wall, time.process_time() - cpu)
+  if config['delete'] and config['discard'] == None:
+    print ('aging.py: --delete requires --discard', file = sys.stderr)
+    return 1
+  if config['policies'] and config['keep'] == None and config['discard'] == None and config['print'] == None:
+    print ('aging.py: --policy requires --keep, --discard or --print', file = sys.stderr)
+    return 1
+  if config['keep'] != None or config['discard'] != None or config['print'] != None:
+    if config['state']:
+      with PhaseTimer (config, 'state'):
+        config['statedata'] = load_state (config)
+    if config['watch'] and config['discard'] == None:
+      print ('aging.py: --watch requires --discard', file = sys.stderr)
+      return 1
+    if config['watch']:
+      try:
+        watch_roots (config, input_names (config))
+      except KeyboardInterrupt:
+        pass
+    elif config['scan']:
+      status = 1 if process_roots (config, input_names (config)) else 0
+    else:
+      status = 1 if process_set (config, input_names (config)) else 0
+    if config['state']:
+      with PhaseTimer (config, 'state'):
+        save_state (config)
+  elif config['spread'] != None:
+    if config['scan']:
+      status = 1 if process_roots (config, input_names (config), process_spread) else 0
+    else:
+      process_spread (config, input_names (config))
+  if config['stats']:
+    config['stats'].add ('total', time.perf_counter() - wall, time.process_time() - cpu)
+    config['stats'].report (sys.stderr)
+  # fallback
+  if not config['keep'] and not config['discard'] and not config['print'] and config['spread'] == None:
+    usage (short = True)
+  return status
+
+if __name__ == '__main__':
+  if os.environ.get ('AGING_PROFILE'):
+    import cProfile, pstats
+    profiler = cProfile.Profile()
+    status = profiler.runcall (main, sys.argv)
+    if os.environ['AGING_PROFILE'] == '-':
+      pstats.Stats (profiler, stream = sys.stderr).sort_stats ('cumulative').print_stats (25)
+    else:
+      profiler.dump_stats (os.environ['AGING_PROFILE'])
+    sys.exit (status)
+  sys.exit (main (sys.argv))
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# This Source Code Form is licensed MPL-2.0: http://mozilla.org/MPL/2.0
+import sys, os, re, time, random, datetime
+sys.path.insert (0, os.path.dirname (os.path.abspath (__file__)))
+import aging
+
+# Reference time stamp extraction, two regex searches per name
+def regex_namedatetime (name):
+  bname = os.path.basename (name)
+  ignores = ('.part', '.tmp', '.temp')
+  for pat in ignores:
+    if bname.find (pat) >= 0:
+      return None
+  digits = re.search (r'(?<!\d)(\d\d\d\d)(\d\d)(\d\d)[^\d]?(\d\d)(\d\d)(?!\d)', bname)
+  if digits:
+    yyyy, mm, dd, hh, ii = digits[1], digits[2], digits[3], digits[4], digits[5]
+    return datetime.datetime (int (yyyy), int (mm), int (dd), int (hh), int (ii))
+  digits = re.search (r'(?<!\d)(\d\d\d\d)(\d\d)(\d\d)(?!\d)', bname)
+  if digits:
+    yyyy, mm, dd = digits[1], digits[2], digits[3]
+    return datetime.datetime (int (yyyy), int (mm), int (dd), 12, 0)
+  return None
+
+# Synthetic backup names, mostly in a few common layouts
+def synthetic_names (count, seed = 0):
+  rand = random.Random (seed)
+  layouts = ('/srv/backups/host-%Y%m%dT%H%M', 'bak-%Y%m%d-%H%M.tar.gz', 'snap%Y%m%d%H%M', 'daily-%Y%m%d',
+             'host2-%Y%m%dT%H%M.part', 'x1-%Y%m%d', 'v2-%Y%m%dT%H%M-1', 'unrelated')
+  start = datetime.datetime (2015, 1, 1)
+  names = []
+  for i in range (count):
+    dtime = start + datetime.timedelta (minutes = rand.randrange (10 * 365 * 24 * 60))
+    names.append (dtime.strftime (layouts[min (rand.randrange (12), len (layouts) - 1)]))
+  return names
+
+# Print the best of `repeat` timings of `function` over all names
+def timeit (label, function, names, repeat = 3):
+  best = None
+  for i in range (repeat):
+    t0 = time.perf_counter()
+    for name in names:
+      function (name)
+    t1 = time.perf_counter()
+    best = t1 - t0 if best is None else min (best, t1 - t0)
+  print ('%-28s %8.3fs %8.0fns/name' % (label, best, best * 1e9 / max (1, len (names))))
+
+# Compare and time time stamp extraction
+def bench_namedatetime (count):
+  names = synthetic_names (count)
+  for name in names[:100000]:
+    assert regex_namedatetime (name) == aging.namedatetime (name), name
+  print ('namedatetime: %u names' % count)
+  timeit ('regex namedatetime', regex_namedatetime, names)
+  timeit ('NameParser compact', aging.namedatetime, names)
+  names.sort() # directory listings group names by prefix
+  timeit ('regex namedatetime, sorted', regex_namedatetime, names)
+  timeit ('NameParser, sorted', aging.namedatetime, names)
+  sayenames = [ 'bak-' + n[-13:-5] + n[-4:] for n in names ]
+  sayenames = [ 'bak-%s-%s-%s-%s:%s:00-snap' % (n[4:8], n[8:10], n[10:12], n[12:14], n[14:16]) for n in sayenames ]
+  parser = aging.NameParser (('sayepurge',))
+  timeit ('NameParser sayepurge', lambda name: aging.namedatetime (name, parser), sayenames)
+
+# Time BackupCollector.feed() and classify() for growing numbers of names
+def bench_collector (maxcount, policy = '48h 14d 8w 12m *y'):
+  now = datetime.datetime (2030, 1, 1, 0, 0)
+  retention = aging.Retention (policy)
+  collector_classes = [ aging.BackupCollector ]
+  if aging.batch_collector() is not aging.BackupCollector:
+    collector_classes += [ aging.BatchCollector ]
+  print ('collector: %s' % retention)
+  print ('%-9s %-16s %10s %10s %10s' % ('names', 'collector', 'feed', 'classify', 'ns/name'))
+  count = 1000
+  while count <= maxcount:
+    # one backup per minute, going back from the virtual now
+    names = [ (now - datetime.timedelta (minutes = i)).strftime ('bak-%Y%m%dT%H%M') for i in range (count) ]
+    for collector_class in collector_classes:
+      collector = collector_class (retention, now = now)
+      t0 = time.perf_counter()
+      collector.collect (names)
+      t1 = time.perf_counter()
+      for name in names:
+        collector.classify (name)
+      t2 = time.perf_counter()
+      print ('%-9u %-16s %9.3fs %9.3fs %10.0f' % (count, collector_class.__name__, t1 - t0, t2 - t1,
+                                                  (t2 - t0) * 1e9 / count))
+    count *= 10
+
+usage = '''Usage: benchmark.py [namedatetime|collector|all] [COUNT]
+Time aging.py time stamp extraction on COUNT names (1000000), or
+BackupCollector feeding and classification from 10^3 up to COUNT names.'''
+
+def main (argv):
+  what = argv[1] if len (argv) > 1 else 'all'
+  count = int (argv[2]) if len (argv) > 2 else 1000000
+  if not what in ('namedatetime', 'collector', 'all'):
+    print (usage)
+    return 1
+  if what in ('namedatetime', 'all'):
+    bench_namedatetime (count)
+  if what in ('collector', 'all'):
+    bench_collector (count)
+  return 0
+
+if __name__ == '__main__':
+  sys.exit (main (sys.argv))
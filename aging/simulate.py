@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# This Source Code Form is licensed MPL-2.0: http://mozilla.org/MPL/2.0
+import sys, os, getopt, random, datetime
+sys.path.insert (0, os.path.dirname (os.path.abspath (__file__)))
+import aging
+
+# Virtual clock times of synthetic backups
+def backup_stream (kind, start, end, seed = 0):
+  rand = random.Random (seed)
+  t = start
+  while t < end:
+    yield t
+    if kind == 'hourly':
+      t += datetime.timedelta (hours = 1)
+    elif kind == 'daily':
+      t += datetime.timedelta (days = 1)
+    else: # irregular, a few backups per day with occasional outages
+      minutes = rand.expovariate (1 / 360.0) if rand.random() > 0.01 else rand.uniform (2, 14) * 1440
+      t += datetime.timedelta (minutes = max (1, int (minutes)))
+
+# Names kept by `retention` at virtual time `now`, with counts per classification
+def purge_names (retention, now, names):
+  collector = aging.BackupCollector (retention, now = now)
+  collector.collect (names)
+  classes = {}
+  kept = []
+  for name in names:
+    cls = collector.classify (name)
+    if not cls in (aging.Classification.DISCARD, aging.Classification.NONE):
+      kept.append (name)
+      classes[cls._name_] = classes.get (cls._name_, 0) + 1
+  return kept, classes
+
+# Replay a backup stream along a virtual clock, purging discarded backups once per `purge` interval
+def simulate (policy, kind = 'hourly', years = 5, purge = datetime.timedelta (hours = 1), report = 'month', seed = 0):
+  start = datetime.datetime (2000, 1, 1, 0, 0)
+  end = start + datetime.timedelta (days = int (365.25 * years))
+  retention = aging.Retention (policy)
+  names = []
+  lastpurge = start
+  lastreport = None
+  maxretained = 0
+  print ('# policy: %s, stream: %s, years: %g' % (retention, kind, years))
+  print ('%-16s %8s  %s' % ('time', 'retained', 'classes'))
+  for t in backup_stream (kind, start, end, seed):
+    names.append (t.strftime ('bak-%Y%m%dT%H%M'))
+    if t - lastpurge < purge:
+      continue
+    lastpurge = t
+    names, classes = purge_names (retention, t, names)
+    maxretained = max (maxretained, len (names))
+    period = t.year if report == 'year' else (t.year, t.month) if report == 'month' else t.date()
+    if period != lastreport:
+      lastreport = period
+      print ('%-16s %8u  %s' % (t.strftime ('%Y-%m-%d %H:%M'), len (names),
+                                ' '.join ('%s=%u' % kv for kv in sorted (classes.items()))))
+  names, classes = purge_names (retention, end, names)
+  maxretained = max (maxretained, len (names))
+  print ('# final: %u retained, at most %u' % (len (names), maxretained))
+  return names
+
+usage = '''Usage: simulate.py [Options] <RETENTION>
+Replay a synthetic stream of backups through aging.py's BackupCollector along
+a virtual clock, purging discarded backups, and report retained counts.
+  -s, --stream <KIND>     Backup stream: hourly, daily or irregular (hourly)
+  -y, --years <YEARS>     Simulated time span (5)
+  -P, --purge <HOURS>     Purge interval in hours (24)
+  -r, --report <PERIOD>   Report every day, month or year (month)
+  --seed <N>              Random seed for irregular streams (0)'''
+
+def main (argv):
+  options, args = getopt.gnu_getopt (argv[1:], 'hs:y:P:r:', [ 'help', 'stream=', 'years=', 'purge=', 'report=', 'seed=' ])
+  kind, years, purge, report, seed = 'hourly', 5.0, 24.0, 'month', 0
+  for k, v in options:
+    if   k in ('-h', '--help'):         print (usage); return 0
+    elif k in ('-s', '--stream'):       kind = v
+    elif k in ('-y', '--years'):        years = float (v)
+    elif k in ('-P', '--purge'):        purge = float (v)
+    elif k in ('-r', '--report'):       report = v
+    elif k == '--seed':                 seed = int (v)
+  if len (args) != 1 or not kind in ('hourly', 'daily', 'irregular'):
+    print (usage)
+    return 1
+  simulate (args[0], kind, years, datetime.timedelta (hours = purge), report, seed)
+  return 0
+
+if __name__ == '__main__':
+  sys.exit (main (sys.argv))
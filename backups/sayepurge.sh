@@ -133,6 +133,46 @@ trap 'rm -rf "$TMPFILEL" "$TMPFILES"' 0 HUP QUIT TRAP USR1 PIPE TERM
 # list backup names, sort recent first
 find . -maxdepth 1 -name "$PREFIX*$POSTFIX" -o -name "$PREFIX*$POSTFIX2" | sort -r | uniq > "$TMPFILEL"
 
+# delegate the purge selection to aging.py if available, it picks the same candidates in O(n log n)
+AGINGPY="${AGINGPY:-`dirname "$0"`/../aging/aging.py}"
+if ! $LISTDELTAS && [ -r "$AGINGPY" ] && which python3 >/dev/null 2>&1 ; then
+  # link names recent first, merged successors are tracked under their original name
+  declare -A nextlist prevlist curname
+  last=
+  while read file ; do
+    curname["$file"]="$file"
+    [ -n "$last" ] && { nextlist["$last"]="$file" ; prevlist["$file"]="$last" ; }
+    last="$file"
+  done < "$TMPFILEL"
+  python3 "$AGINGPY" -t sayepurge --spread "$NKEEPS" --guard "$NGUARDED" ${MAXDELETE:+--max-delete "$MAXDELETE"} \
+    --from-file "$TMPFILEL" > "$TMPFILES" || die 3 "Failed to select purge candidates: $AGINGPY"
+  while IFS= read -r line ; do
+    case "$line" in
+      "Ignore: "*)  msg "$line" ;;
+      "Keep:   "*)  msg "Keep:   ${curname[${line#Keep:   }]}" ;;
+      "Purge:  "*)
+        file="${line#Purge:  }"
+        candidate="${curname[$file]}"
+        if $INC ; then
+          msg "Merge:  $candidate"
+        else
+          msg "Purge:  $candidate"
+        fi
+        next="${nextlist[$file]}"
+        prev="${prevlist[$file]}"
+        if [ -n "$next" ] ; then
+          curname["$next"]=`delete_merge "$candidate" "${curname[$next]}"`
+          prevlist["$next"]="$prev"
+        else
+          delete_merge "$candidate" "" >/dev/null
+        fi
+        [ -n "$prev" ] && nextlist["$prev"]="$next"
+        ;;
+    esac
+  done < "$TMPFILES"
+  exit
+fi
+
 # extract time stamps by matching YYYY-MM-DD-hh:mm:ss
 sed "s/\.\/$PREFIX\([0-9]\+-[0-9]\+-[0-9]\+\)-\([0-9]\+:[0-9]\+:[0-9]\+\).*/\1 \2/" < "$TMPFILEL" > "$TMPFILES"
 
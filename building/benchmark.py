@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 Tim Janik
+# Redistributable under GNU GPLv3 or later: http://www.gnu.org/licenses/gpl.html
+import sys, os, getopt, time, random, threading, resource, subprocess, StringIO
+sys.path.insert (0, os.path.dirname (os.path.abspath (__file__)))
+import buglist, fakebugzilla
+
+# list `count` random bug ids through read_handle_bugs(), report wall time, HTTP counters and peak RSS
+def bench_buglist (url, count, rows, config):
+  rand = random.Random (count)
+  ids = [ rand.randrange (1, rows + rows // 10 + 2) for i in range (count) ]   # ~10% (NOBUG)
+  stdin, stdout = sys.stdin, sys.stdout
+  sys.stdin = StringIO.StringIO (''.join ([ '%u\n' % i for i in ids ]))
+  sys.stdout = open (os.devnull, 'w')
+  t0 = time.time()
+  try:
+    buglist.read_handle_bugs (config, url)
+  finally:
+    sys.stdin, sys.stdout = stdin, stdout
+  t1 = time.time()
+  pool = buglist.httppool
+  peak = resource.getrusage (resource.RUSAGE_SELF).ru_maxrss / 1024.0     # Linux reports KiB
+  return '%-9u %9.3fs %9u %9u %12u %8.1fMB' % (count, t1 - t0, pool.requests, pool.connections, pool.bytes, peak)
+
+usage = '''Usage: benchmark.py [Options] [COUNT...]
+Time buglist.py listing COUNT bugs (10 1000 100000) from a local fakebugzilla.py
+server, each COUNT in a new process so its peak RSS is measured on its own.
+  -j, --jobs <N>          Concurrent buglist.py queries (4)
+  -l, --latency <SECS>    Delay of each fake Bugzilla response (0.05)
+  -r, --rows <ROWS>       Bugs in the fake database (100000)
+  -c, --columns <LAYOUT>  Fake CSV columns: default, short or minimal
+  -U                      Keep bug lists unsorted'''
+
+def main (argv):
+  options, args = getopt.gnu_getopt (argv[1:], 'hj:l:r:c:U', [ 'help', 'jobs=', 'latency=', 'rows=', 'columns=', 'url=' ])
+  jobs, latency, rows, layout, sort, url = 4, 0.05, 100000, 'default', True, None
+  for k, v in options:
+    if   k in ('-h', '--help'):         print usage; return 0
+    elif k in ('-j', '--jobs'):         jobs = int (v)
+    elif k in ('-l', '--latency'):      latency = float (v)
+    elif k in ('-r', '--rows'):         rows = int (v)
+    elif k in ('-c', '--columns'):      layout = v
+    elif k == '-U':                     sort = False
+    elif k == '--url':                  url = v             # internal, run a single COUNT against url
+  if not fakebugzilla.layouts.has_key (layout):
+    print usage
+    return 1
+  counts = [ int (float (a)) for a in args ] or [ 10, 1000, 100000 ]
+  config = { 'sort': sort, 'show-query': False, 'show-list': True, 'jobs': jobs, 'max-url': 2000 }
+  if url:
+    print bench_buglist (url, counts[0], rows, config)
+    return 0
+  server = fakebugzilla.FakeBugzilla (('127.0.0.1', 0), rows, latency, layout)
+  thread = threading.Thread (target = server.serve_forever)
+  thread.daemon = True
+  thread.start()
+  print 'buglist: %u jobs, %s, %u rows, %.3fs latency, %s columns' % (jobs, 'sorted' if sort else 'unsorted', rows, latency, layout)
+  print '%-9s %10s %9s %9s %12s %10s' % ('ids', 'wall', 'requests', 'conns', 'bytes', 'peak RSS')
+  for count in counts:
+    command = [ sys.executable, os.path.abspath (__file__), '--url=' + server.url(), '-j%u' % jobs, '-r%u' % rows ]
+    command += [ '-U' ] if not sort else []
+    sys.stdout.flush()
+    subprocess.check_call (command + [ str (count) ])
+  server.shutdown()
+  return 0
+
+if __name__ == '__main__':
+  sys.exit (main (sys.argv))
@@ -15,7 +15,7 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
-import sys, os, re, urllib, csv
+import sys, os, re, urllib, csv, json, threading, Queue, httplib, urlparse, zlib, socket, stat, time
 pkginstall_configvars = {
   'VERSION' : '0.0'
   #@PKGINSTALL_CONFIGVARS_IN24LINES@ # configvars are substituted upon script installation
@@ -61,18 +61,148 @@ def add_auth (url):
       return ai + url[pl:]
   return url
 
-# carry out online bug queries
-def bug_summaries (buglisturl):
+# response of a pooled connection, the connection is returned to its pool once the body is consumed
+class PooledResponse:
+  def __init__ (self, pool, key, conn, response):
+    self.pool, self.key, self.conn, self.response = pool, key, conn, response
+    self.status = response.status
+    gzipped = (response.getheader ('content-encoding') or '').lower() in ('gzip', 'x-gzip')
+    self.decoder = zlib.decompressobj (16 + zlib.MAX_WBITS) if gzipped else None
+  def read (self):
+    data = self.response.read()
+    self.pool.count (len (data))
+    if self.decoder:
+      data = self.decoder.decompress (data) + self.decoder.flush()
+    return data
+  def __iter__ (self):
+    # yield lines of the body as soon as they arrive
+    tail = ''
+    while True:
+      raw = self.response.read (8192)
+      self.pool.count (len (raw))
+      data = raw
+      if self.decoder:
+        data = self.decoder.decompress (raw) if raw else self.decoder.flush()
+      lines = (tail + data).splitlines (True)
+      tail = lines.pop() if lines and not lines[-1].endswith (('\n', '\r')) else ''
+      for line in lines:
+        yield line
+      if not raw:
+        break
+    if tail:
+      yield tail
+  def close (self):
+    if self.conn:
+      if self.response.isclosed() and not self.response.will_close:
+        self.pool.release (self.key, self.conn)
+      else:
+        self.conn.close()
+      self.conn = None
+
+# per host pool of keep-alive HTTP connections, shared by all query threads,
+# honouring http_proxy, https_proxy and no_proxy like urllib.urlopen()
+class HttpPool:
+  def __init__ (self, timeout = 60):
+    self.lock = threading.Lock()
+    self.idle = {}              # (scheme, host, port, proxy) -> [ connection, ... ]
+    self.timeout = timeout
+    self.proxies = urllib.getproxies()
+    self.connections, self.requests, self.bytes = 0, 0, 0
+  def proxy (self, scheme, host):
+    # (host, port, Proxy-Authorization) of the proxy for scheme://host, None for direct connections
+    proxy = self.proxies.get (scheme)
+    if not proxy or urllib.proxy_bypass (host):
+      return None
+    parts = urlparse.urlsplit (proxy if '://' in proxy else 'http://' + proxy)
+    auth = None
+    if parts.username is not None:
+      import base64
+      auth = 'Basic ' + base64.b64encode (urllib.unquote (parts.username) + ':' + urllib.unquote (parts.password or ''))
+    return (parts.hostname, parts.port or 80, auth)
+  def acquire (self, key):
+    with self.lock:
+      if self.idle.get (key):
+        return self.idle[key].pop(), True
+      self.connections += 1
+    scheme, host, port, proxy = key
+    if proxy and scheme == 'https':
+      # CONNECT tunnel through the proxy
+      conn = httplib.HTTPSConnection (proxy[0], proxy[1], timeout = self.timeout)
+      conn.set_tunnel (host, port, { 'Proxy-Authorization': proxy[2] } if proxy[2] else None)
+      return conn, False
+    if proxy:
+      return httplib.HTTPConnection (proxy[0], proxy[1], timeout = self.timeout), False
+    if scheme == 'https':
+      return httplib.HTTPSConnection (host, port, timeout = self.timeout), False
+    return httplib.HTTPConnection (host, port, timeout = self.timeout), False
+  def release (self, key, conn):
+    with self.lock:
+      self.idle.setdefault (key, []).append (conn)
+  def count (self, nbytes):
+    with self.lock:
+      self.bytes += nbytes
+  def open (self, url, redirects = 5):
+    # GET url with gzip transfer encoding, URL credentials are sent as basic authentication
+    parts = urlparse.urlsplit (url)
+    headers = { 'Accept-Encoding': 'gzip', 'Connection': 'keep-alive',
+                'User-Agent': 'buglist/%s' % pkginstall_configvars['VERSION'] }
+    if parts.username is not None:
+      import base64
+      userpass = urllib.unquote (parts.username) + ':' + urllib.unquote (parts.password or '')
+      headers['Authorization'] = 'Basic ' + base64.b64encode (userpass)
+    proxy = self.proxy (parts.scheme, parts.hostname)
+    key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80), proxy)
+    path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+    if proxy and parts.scheme == 'http':
+      # plain HTTP proxies take absolute URIs, without credentials
+      path = '%s://%s%s' % (parts.scheme, parts.netloc.rsplit ('@', 1)[-1], path)
+      if proxy[2]:
+        headers['Proxy-Authorization'] = proxy[2]
+    conn, reused = self.acquire (key)
+    with self.lock:
+      self.requests += 1
+    try:
+      conn.request ('GET', path, headers = headers)
+      response = conn.getresponse()
+    except (httplib.HTTPException, IOError):
+      conn.close()
+      if not reused:
+        raise
+      # idle connection was closed by the server, retry with a new one
+      with self.lock:
+        self.connections += 1
+      conn.connect()
+      conn.request ('GET', path, headers = headers)
+      response = conn.getresponse()
+    result = PooledResponse (self, key, conn, response)
+    location = response.getheader ('location')
+    if response.status in (301, 302, 303, 307, 308) and location and redirects > 0:
+      result.read()
+      result.close()
+      location = urlparse.urljoin (url, location)
+      # keep credentials only for the same scheme and host:port, never pass them on to other servers
+      target = urlparse.urlsplit (location)
+      samehost = key[:3] == (target.scheme, target.hostname, target.port or (443 if target.scheme == 'https' else 80))
+      if parts.username is not None and samehost and not '@' in target.netloc:
+        location = location.replace ('://', '://%s@' % parts.netloc.rsplit ('@', 1)[0], 1)
+      return self.open (location, redirects - 1)
+    return result
+
+httppool = HttpPool()
+
+# carry out online bug queries, yield (bug_number, description) rows as the CSV response arrives,
+# if `columns` are given, only those are queried and description is a tuple of their values
+def iter_bug_summaries (buglisturl, columns = None):
   if not buglisturl:
-    return []
+    return
   # Bugzilla query to use
   query = buglisturl + '&ctype=csv' # buglisturl.replace (',', '%2c')
+  if columns:
+    query += '&columnlist=' + ','.join (columns)
   query = add_auth (query)
-  f = urllib.urlopen (query)
-  csvdata = f.read()
-  f.close()
+  f = httppool.open (query)
   # read CSV lines
-  reader = csv.reader (csvdata.splitlines (1))
+  reader = csv.reader (f)
   # parse head to interpret columns
   col_bug_id = -1
   col_description = -1
@@ -90,64 +220,604 @@ def bug_summaries (buglisturl):
   if col_bug_id < 0:
     print >>sys.stderr, 'Failed to identify bug_id from CSV data'
     sys.exit (11)
-  if col_description < 0:
+  if col_description < 0 and not columns:
     print >>sys.stderr, 'Failed to identify description columns from CSV data'
     sys.exit (12)
-  # parse bug list
-  result = []
-  summary = ''
+  # parse bug list, columns missing from the response are empty
+  header = [ col.strip() for col in header ]
+  cols = [ header.index (col) if col in header else None for col in columns or [] ]
   for row in reader:
-    bug_number = row[col_bug_id]
-    description = row[col_description]
-    result += [ (bug_number, description) ]
-  return result
+    if not row:
+      continue                  # line break split across reads
+    if columns:
+      yield (row[col_bug_id], tuple ([ '' if i is None else row[i] for i in cols ]))
+    else:
+      yield (row[col_bug_id], row[col_description])
+  f.close()
 
-# parse bug numbers and list bugs
-def read_handle_bugs (config, url):
-  lines = sys.stdin.read()
-  # print >>sys.stderr, 'Using bugzilla URL: %s' % (bz, url)
-  for line in [ lines ]:
-    # find all bug numbers
-    bugs = re.findall (r'\b[0-9]+\b', line)
-    # int-convert, dedup and sort bug numbers
-    ibugs = []
-    if bugs:
-      bught = {}
-      for b in bugs:
-        b = int (b)
-        if not b or bught.has_key (b): continue
-        bught[b] = True
-        ibugs += [ b ]
-    del bugs
-    if config.get ('sort', False):
-      ibugs.sort()
-    # construct full query URL
-    fullurl = url + ','.join ([str (b) for b in ibugs])
-    # print fullurl
-    if len (ibugs) and config.get ('show-query', False):
-      print fullurl
-    # print bug summaries
-    if len (ibugs) and config.get ('show-list', False):
-      bught = {}
-      for bug in bug_summaries (fullurl):
-        bught[int (bug[0])] = bug[1] # bug summaries can have random order
-      for bugid in ibugs: # print bugs in user provided order
-        iid = int (bugid)
-        if bught.has_key (iid):
-          desc = bught[iid]
-          if len (desc) >= 70:
-            desc = desc[:67].rstrip() + '...'
-          print "% 7u - %s" % (iid, desc)
+# carry out online bug queries
+def bug_summaries (buglisturl, columns = None):
+  return list (iter_bug_summaries (buglisturl, columns))
+
+# carry out a Bugzilla CSV query, yield a dict per bug row as the response arrives
+def iter_bug_rows (query):
+  f = httppool.open (add_auth (query))
+  reader = csv.reader (f)
+  header = [ col.strip() for col in reader.next() ]
+  for row in reader:
+    if row:
+      yield dict (zip (header, row))
+  f.close()
+
+# background job of a WorkerPool
+class Job:
+  def __init__ (self, func, args):
+    self.func, self.args = func, args
+    self.event = threading.Event()
+    self.value, self.error = None, None
+  def done (self):
+    return self.event.is_set()
+  def result (self):
+    while not self.event.wait (86400): # timeout keeps KeyboardInterrupt working
+      pass
+    if self.error:
+      raise self.error[0], self.error[1], self.error[2]
+    return self.value
+
+# threads that run submitted jobs, up to `jobs` at a time
+class WorkerPool:
+  def __init__ (self, jobs = 4):
+    self.queue = Queue.Queue()
+    for i in range (max (1, jobs)):
+      t = threading.Thread (target = self.worker)
+      t.daemon = True
+      t.start()
+  def worker (self):
+    while True:
+      job = self.queue.get()
+      try:
+        job.value = job.func (*job.args)
+      except BaseException:
+        job.error = sys.exc_info()
+      job.event.set()
+  def submit (self, func, *args):
+    job = Job (func, args)
+    self.queue.put (job)
+    return job
+
+# persistent cache of bug summaries, keyed by tracker URL and bug id
+class BugCache:
+  def __init__ (self, filename, ttl = 86400):
+    import sqlite3, time
+    dirname = os.path.dirname (filename)
+    if dirname and not os.path.isdir (dirname):
+      os.makedirs (dirname)
+    self.db = sqlite3.connect (filename)
+    self.db.execute ('CREATE TABLE IF NOT EXISTS summaries (tracker TEXT, bug INTEGER, summary TEXT, ' +
+                     'fetched REAL, PRIMARY KEY (tracker, bug))')
+    self.ttl = ttl
+    self.time = time.time
+  def lookup (self, tracker, ids, expired = False):
+    # map ids to cached summaries, None for cached (NOBUG) entries; skip entries older than ttl unless expired
+    since = 0 if expired else self.time() - self.ttl
+    result = {}
+    for i in range (0, len (ids), 500):
+      batch = ids[i:i+500]
+      query = 'SELECT bug, summary FROM summaries WHERE tracker = ? AND fetched >= ? AND bug IN (%s)'
+      for bug, summary in self.db.execute (query % ','.join ('?' * len (batch)), [ tracker, since ] + batch):
+        result[bug] = summary
+    return result
+  def store (self, tracker, found):
+    # store summaries for a dict of ids, None values record (NOBUG)
+    now = self.time()
+    self.db.executemany ('INSERT OR REPLACE INTO summaries VALUES (?, ?, ?, ?)',
+                         [ (tracker, bug, summary, now) for bug, summary in found.items() ])
+    self.db.commit()
+
+# default cache file location
+def cache_file():
+  cachedir = os.environ.get ('XDG_CACHE_HOME') or os.path.expanduser ('~/.cache')
+  return os.path.join (cachedir, 'buglist.sqlite')
+
+# full-text index of bug summaries imported from tracker CSV exports
+class BugIndex:
+  def __init__ (self, filename):
+    import sqlite3, time
+    dirname = os.path.dirname (filename)
+    if dirname and not os.path.isdir (dirname):
+      os.makedirs (dirname)
+    self.db = sqlite3.connect (filename)
+    self.db.execute ('CREATE TABLE IF NOT EXISTS bugs (id INTEGER PRIMARY KEY, tracker TEXT, bug INTEGER, ' +
+                     'UNIQUE (tracker, bug))')
+    self.db.execute ('CREATE TABLE IF NOT EXISTS imports (tracker TEXT PRIMARY KEY, maxbug INTEGER, changed TEXT)')
+    try:
+      self.db.execute ('CREATE VIRTUAL TABLE IF NOT EXISTS bugtext USING fts5 (summary)')
+    except sqlite3.OperationalError:
+      self.db.execute ('CREATE VIRTUAL TABLE IF NOT EXISTS bugtext USING fts4 (summary)') # older SQLite
+    self.time = time
+  def state (self, tracker):
+    # highest imported bug id and latest change time of tracker
+    row = self.db.execute ('SELECT maxbug, changed FROM imports WHERE tracker = ?', (tracker,)).fetchone()
+    return row or (0, None)
+  def store (self, tracker, rows, maxbug, changed):
+    # (re-)index (bug, summary) rows and record the import state
+    for bug, summary in rows:
+      self.db.execute ('INSERT OR IGNORE INTO bugs (tracker, bug) VALUES (?, ?)', (tracker, bug))
+      rowid = self.db.execute ('SELECT id FROM bugs WHERE tracker = ? AND bug = ?', (tracker, bug)).fetchone()[0]
+      self.db.execute ('DELETE FROM bugtext WHERE rowid = ?', (rowid,))
+      self.db.execute ('INSERT INTO bugtext (rowid, summary) VALUES (?, ?)', (rowid, summary.decode ('utf-8', 'replace')))
+    self.db.execute ('INSERT OR REPLACE INTO imports VALUES (?, ?, ?)', (tracker, maxbug, changed))
+    self.db.commit()
+  def refresh (self, tracker, pagesize = 1000):
+    # page through the CSV export of tracker: bugs changed since the last import, then bugs above the highest id
+    maxbug, changed = self.state (tracker)
+    since = self.time.strftime ('%Y-%m-%d', self.time.gmtime (self.time.time() - 86400))
+    base = tracker.split ('?', 1)[0] + '?ctype=csv&columnlist=short_desc,changeddate&order=bug_id&limit=%u' % pagesize
+    count = 0
+    queries = [ (base + '&chfieldfrom=%s&chfieldto=Now' % urllib.quote (changed), False) ] if changed else []
+    queries += [ (base + '&f1=bug_id&o1=greaterthan&v1=', True) ]
+    for query, byid in queries:
+      offset = 0
+      while True:
+        # changed bugs are paged by offset, new bugs by their id
+        url = query + str (maxbug) if byid else query + '&offset=%u' % offset
+        rows = []
+        for row in iter_bug_rows (url):
+          bug = int (row['bug_id'])
+          rows += [ (bug, row.get ('short_desc', '')) ]
+          maxbug = max (maxbug, bug)
+          if row.get ('changeddate') and (not changed or row['changeddate'] > changed):
+            changed = row['changeddate']
+        self.store (tracker, rows, maxbug, changed or since)
+        count += len (rows)
+        offset += len (rows)
+        if len (rows) < pagesize:
+          break
+    return count
+  def search (self, text, tracker = None):
+    # yield (tracker, bug, summary) for bugs matching the full-text query, per tracker by bug id
+    import sqlite3
+    query = 'SELECT tracker, bug, summary FROM bugtext JOIN bugs ON bugs.id = bugtext.rowid WHERE bugtext MATCH ?'
+    args = (text,)
+    if tracker:
+      query, args = query + ' AND tracker = ?', args + (tracker,)
+    try:
+      rows = self.db.execute (query + ' ORDER BY tracker, bug', args).fetchall()
+    except sqlite3.OperationalError:
+      # not in query syntax, search for the plain words
+      words = [ '"%s"' % w.replace ('"', '""') for w in text.split() ]
+      rows = self.db.execute (query + ' ORDER BY tracker, bug', (' '.join (words),) + args[1:]).fetchall()
+    for tracker, bug, summary in rows:
+      yield tracker, bug, summary.encode ('utf-8')
+
+# default index file location
+def index_file():
+  cachedir = os.environ.get ('XDG_CACHE_HOME') or os.path.expanduser ('~/.cache')
+  return os.path.join (cachedir, 'buglist-index.sqlite')
+
+# split bugs into lists whose query URLs stay within maxlen chars
+def split_bugs (baselen, bugs, maxlen):
+  chunks, length = [], maxlen
+  for bug in bugs:
+    n = len (str (bug)) + 1
+    if not chunks or length + n > maxlen:
+      chunks, length = chunks + [ [] ], baselen
+    chunks[-1].append (bug)
+    length += n
+  return chunks
+
+# socket family and address of [HOST:]PORT, HOST defaults to localhost, or else of a Unix socket path
+def parse_address (address):
+  host, port = address.rsplit (':', 1) if ':' in address else ('', address)
+  if '/' in address or not port.isdigit():
+    return socket.AF_UNIX, address
+  return socket.AF_INET, (host or '127.0.0.1', int (port))
+
+# lookups of a BugService, coalesced into one query per tracker and column selection
+class ServiceBatch:
+  def __init__ (self):
+    self.bugs = set()
+    self.found = {}
+    self.error = None
+    self.event = threading.Event()
+
+# in-memory LRU of bug summaries, misses of lookups arriving within `coalesce` seconds are
+# resolved together in URL length bounded queries per tracker
+class BugService:
+  def __init__ (self, config):
+    import collections
+    self.lock = threading.Lock()
+    self.lru = collections.OrderedDict() # (url, columns, bug) -> (fetched, summary)
+    self.size, self.ttl = config.get ('lru', 65536), config.get ('ttl', 86400)
+    self.coalesce, self.maxurl = config.get ('coalesce', 0.05), config.get ('max-url', 2000)
+    self.batches = {}                    # (url, columns) -> ServiceBatch collecting misses
+    self.pool = WorkerPool (config.get ('jobs', 4))
+  def lookup (self, url, bugs, columns = None):
+    # map bugs to summaries, None for (NOBUG)
+    columns = tuple (columns) if columns else None
+    result, missing, batch = {}, [], None
+    with self.lock:
+      since = time.time() - self.ttl
+      for bug in bugs:
+        entry = self.lru.pop ((url, columns, bug), None)
+        if entry and entry[0] >= since:
+          self.lru[(url, columns, bug)] = entry # most recently used
+          result[bug] = entry[1]
         else:
-          print "% 7u (NOBUG)" % iid
+          missing += [ bug ]
+      if missing:
+        batch = self.batches.get ((url, columns))
+        if not batch:
+          batch = self.batches[(url, columns)] = ServiceBatch()
+          timer = threading.Timer (self.coalesce, self.dispatch, (url, columns))
+          timer.daemon = True
+          timer.start()
+        batch.bugs.update (missing)
+    if batch:
+      while not batch.event.wait (86400): # timeout keeps KeyboardInterrupt working
+        pass
+      if batch.error:
+        raise IOError (batch.error)
+      for bug in missing:
+        result[bug] = batch.found.get (bug)
+    return result
+  def dispatch (self, url, columns):
+    # query the bugs of a batch once its coalescing window is over
+    with self.lock:
+      batch = self.batches.pop ((url, columns))
+    try:
+      baselen = len (add_auth (url + '&ctype=csv' + ('&columnlist=' + ','.join (columns) if columns else '')))
+      jobs = [ self.pool.submit (bug_summaries, url + ','.join ([ str (b) for b in bugs ]), columns)
+               for bugs in split_bugs (baselen, sorted (batch.bugs), self.maxurl) ]
+      for job in jobs:
+        for bug, summary in job.result():
+          batch.found[int (bug)] = summary
+    except BaseException, err:
+      batch.error = '%s: %s' % (err.__class__.__name__, err)
+    else:
+      with self.lock:
+        now = time.time()
+        for bug in batch.bugs:
+          self.lru.pop ((url, columns, bug), None)
+          self.lru[(url, columns, bug)] = (now, batch.found.get (bug))
+        while len (self.lru) > self.size:
+          self.lru.popitem (False)
+    batch.event.set()
+
+# thin client of a BugService listening at address
+class ServiceClient:
+  def __init__ (self, address):
+    family, address = parse_address (address)
+    self.sock = socket.socket (family, socket.SOCK_STREAM)
+    self.sock.connect (address)
+    self.rfile, self.wfile = self.sock.makefile ('rb'), self.sock.makefile ('wb')
+  def lookup (self, url, bugs, columns = None):
+    # map bugs to summaries, None for (NOBUG)
+    self.wfile.write (json.dumps ({ 'tracker': url, 'bugs': bugs, 'columns': columns }) + '\n')
+    self.wfile.flush()
+    reply = json.loads (self.rfile.readline() or '{ "error": "connection closed" }')
+    if reply.get ('error'):
+      raise IOError (reply['error'])
+    result = {}
+    for bug, summary in reply['found'].items():
+      if isinstance (summary, list):
+        summary = tuple ([ v.encode ('utf-8') for v in summary ])
+      elif summary is not None:
+        summary = summary.encode ('utf-8')
+      result[int (bug)] = summary
+    return result
+
+# print a bug summary line, desc is None for unknown bugs
+def print_bug (label, desc, missing = '(NOBUG)'):
+  label = ('% 7u' if isinstance (label, (int, long)) else '%7s') % label
+  if desc is None:
+    print "%s %s" % (label, missing)
+    return
+  if isinstance (desc, tuple):
+    desc = ' | '.join (desc)
+  if len (desc) >= 70:
+    desc = desc[:67].rstrip() + '...'
+  print "%s - %s" % (label, desc)
+
+# print bugs as CSV or JSON lines records of bug tracker, bug id and column values
+class RecordWriter:
+  def __init__ (self, format, columns):
+    self.format, self.columns = format, columns
+    self.aliases = {}
+    for alias, bugurl in bugurls:
+      self.aliases.setdefault (bugurl, alias)
+    if format == 'csv':
+      self.writer = csv.writer (sys.stdout, lineterminator = '\n')
+      self.writer.writerow ([ 'tracker', 'bug_id' ] + columns)
+  def write (self, url, bug, values):
+    # values are None for unknown bugs, which have empty columns
+    values = values or [ None ] * len (self.columns)
+    if self.format == 'csv':
+      self.writer.writerow ([ self.aliases.get (url, url), bug ] + [ '' if v is None else v for v in values ])
+    else:
+      record = [ ('tracker', self.aliases.get (url, url)), ('bug_id', bug) ] + zip (self.columns, values)
+      sys.stdout.write (json.dumps (dict (record), sort_keys = True) + '\n')
+
+# bug query of a BugLister, its CSV rows are passed on through a queue while they arrive
+class QueryChunk:
+  def __init__ (self, url, bugs, columns = None):
+    self.url, self.bugs, self.columns = url, bugs, columns
+    self.rows = Queue.Queue()   # (bug_number, description) rows, None once complete
+    self.found = {}             # bug -> summary, received rows
+    self.unprinted = len (bugs)
+    self.job = None
+    self.complete = False
+  def run (self):
+    try:
+      for row in iter_bug_summaries (self.url + ','.join ([str (b) for b in self.bugs]), self.columns):
+        self.rows.put (row)
+    finally:
+      self.rows.put (None)
+
+# resolve bug summaries per tracker in URL length bounded query chunks and print them in the order
+# of add(), as soon as the summary of the next bug is available. Only a window of queries runs ahead
+# of the output, so rows received out of order are buffered for a bounded number of chunks.
+class BugLister:
+  def __init__ (self, config, pool):
+    self.config, self.pool = config, pool
+    self.cache, self.offline = config.get ('cache'), config.get ('offline', False)
+    self.service = config.get ('service')
+    self.window = 2 * config.get ('jobs', 4)
+    self.format, self.columns = config.get ('format', 'text'), config.get ('columns')
+    if self.format != 'text':
+      self.columns = self.columns or [ 'short_desc' ]
+      self.writer = RecordWriter (self.format, self.columns)
+    self.order = []             # (url, bug, label) in output order
+    self.known = {}             # (url, bug) -> summary from the cache, None for (NOBUG)
+    self.chunks = {}            # (url, bug) -> QueryChunk for its summary
+    self.queued = []            # QueryChunk list, not yet submitted
+    self.running = 0            # submitted chunks that are not complete
+    self.candidates = {}        # url -> bugs awaiting cache lookup
+    self.pending = {}           # url -> [ bugs, URL length ] of the next query
+    self.uncached = set()       # (url, bug) not available --offline
+    self.printed = 0
+  def add (self, url, bug, label):
+    self.order += [ (url, bug, label) ]
+    candidates = self.candidates.setdefault (url, [])
+    candidates += [ bug ]
+    if len (candidates) >= 256:
+      self.lookup (url)
+  def lookup (self, url):
+    # use cached summaries, only query cache misses and expired entries
+    bugs = self.candidates.pop (url, [])
+    if self.service:
+      try:
+        found = self.service.lookup (url, bugs, self.columns)
+      except (IOError, ValueError), err:
+        # service went away or failed, query the remaining bugs directly
+        print >>sys.stderr, "%s: %s: %s" % (os.path.basename (sys.argv[0]), self.config.get ('connect'), str (err))
+        self.service = None
+      else:
+        for bug, desc in found.items():
+          self.known[(url, bug)] = desc
+        return
+    cached = self.cache.lookup (self.cachekey (url), bugs, self.offline) if self.cache else {}
+    for bug in bugs:
+      if cached.has_key (bug):
+        self.known[(url, bug)] = self.decode (cached[bug])
+      elif self.offline:
+        self.uncached.add ((url, bug))
+      else:
+        self.enqueue (url, bug)
+  def enqueue (self, url, bug):
+    # add bug to the next query of url, queue the query once its URL length is exhausted
+    base = len (add_auth (self.cachekey (url) + '&ctype=csv'))
+    pending = self.pending.setdefault (url, [ [], base ])
+    if pending[0] and pending[1] + 1 + len (str (bug)) > self.config.get ('max-url', 2000):
+      self.queue (url)
+      pending = self.pending.setdefault (url, [ [], base ])
+    pending[1] += len (str (bug)) + (1 if pending[0] else 0)
+    pending[0] += [ bug ]
+  def queue (self, url):
+    chunk = QueryChunk (url, self.pending.pop (url)[0], self.columns)
+    for bug in chunk.bugs:
+      self.chunks[(url, bug)] = chunk
+    self.queued += [ chunk ]
+    self.start()
+  def start (self, chunk = None):
+    # submit queued chunks while the window allows, and `chunk` regardless
+    while self.queued and (self.running < self.window or chunk in self.queued):
+      first = self.queued.pop (0)
+      first.job = self.pool.submit (first.run)
+      self.running += 1
+  def cachekey (self, url):
+    # summaries are cached per tracker and column selection
+    return url + '&columnlist=' + ','.join (self.columns) if self.columns else url
+  def encode (self, desc):
+    return json.dumps (desc) if self.columns and desc is not None else desc
+  def decode (self, desc):
+    if self.columns and desc is not None:
+      return tuple ([ v.encode ('utf-8') for v in json.loads (desc) ])
+    return desc
+  def flush (self):
+    # look up and query all remaining bugs
+    for url in self.candidates.keys():
+      self.lookup (url)
+    for url in self.pending.keys():
+      self.queue (url)
+  def receive (self, chunk, bug, wait):
+    # take rows from chunk until bug is found or the query completed, returns False if rows are missing
+    while not chunk.complete and not chunk.found.has_key (bug):
+      try:
+        row = chunk.rows.get (wait, 86400) if wait else chunk.rows.get_nowait()
+      except Queue.Empty:
+        return False
+      if row is None:
+        chunk.job.result()      # raise query errors
+        chunk.complete = True
+        self.running -= 1
+        if self.cache:
+          self.cache.store (self.cachekey (chunk.url), dict ([ (b, self.encode (chunk.found.get (b))) for b in chunk.bugs ]))
+        self.start()
+      else:
+        chunk.found[int (row[0])] = row[1] # bug summaries can have random order
+    return True
+  def output (self, wait = False):
+    # print bugs in order as far as summaries are known, or all bugs if `wait`
+    while self.printed < len (self.order):
+      url, bug, label = self.order[self.printed]
+      key = (url, bug)
+      if self.known.has_key (key):
+        desc = self.known.pop (key)
+      elif key in self.uncached:
+        desc = None
+      elif self.chunks.has_key (key):
+        chunk = self.chunks[key]
+        if not chunk.job:
+          self.start (chunk)
+        if not self.receive (chunk, bug, wait):
+          break
+        desc = chunk.found.get (bug)
+        del self.chunks[key]
+        chunk.unprinted -= 1
+        if not chunk.unprinted:
+          self.receive (chunk, None, True) # complete the query to update the cache and window
+      else:
+        break                   # awaiting cache lookup or query
+      if self.format != 'text':
+        self.writer.write (url, bug, desc)
+      else:
+        print_bug (label, desc, '(OFFLINE)' if key in self.uncached else '(NOBUG)')
+      self.printed += 1
+    sys.stdout.flush()
+
+# match bug numbers, optionally qualified by a bug tracker alias, e.g. gb#123 or moz:456
+bugref_pattern = re.compile (r'(?:\b(%s)[#:])?\b([0-9]+)\b' %
+                             '|'.join (sorted ([re.escape (k) for k, u in bugurls], key = len, reverse = True)), re.I)
+
+# parse bug numbers from stdin line by line and list bugs, unqualified numbers refer to `url`
+def read_handle_bugs (config, url):
+  trackerdict = dict (bugurls)
+  lister = BugLister (config, WorkerPool (config.get ('jobs', 4)))
+  showlist = config.get ('show-list', False)
+  stream = not config.get ('sort', False)
+  refs, seen = [], set()        # (url, bug, label) deduplicated in input order
+  aliases = {}                  # url -> first alias used for it
+  unqualified = False           # warned about numbers without bug tracker
+  for line in iter (sys.stdin.readline, ''):
+    for alias, number in bugref_pattern.findall (line):
+      bug = int (number)
+      bugurl = trackerdict[alias.lower()] if alias else url
+      if bug and not bugurl and not unqualified:
+        print >>sys.stderr, "%s: Missing bug tracker argument, ignoring unqualified bug numbers like: %u" % (
+          os.path.basename (sys.argv[0]), bug)
+        unqualified = True
+      if not bug or not bugurl or (bugurl, bug) in seen:
+        continue
+      seen.add ((bugurl, bug))
+      if bugurl != url:
+        aliases.setdefault (bugurl, alias.lower())
+      refs += [ (bugurl, bug, bug if bugurl == url else '%s#%u' % (aliases[bugurl], bug)) ]
+      if stream and showlist:
+        lister.add (*refs[-1])
+    if stream and showlist:
+      lister.output()           # early output of resolved bugs
+  del seen
+  if not stream:
+    # sort bug numbers per tracker, trackers in order of first reference
+    trackers = {}
+    for ref in refs:
+      trackers.setdefault (ref[0], len (trackers))
+    refs.sort (key = lambda ref: (trackers[ref[0]], ref[1]))
+  # construct full query URLs per tracker
+  fullurls, trackerids = [], {}
+  for ref in refs:
+    if not trackerids.has_key (ref[0]):
+      trackerids[ref[0]] = []
+      fullurls += [ (ref[0], trackerids[ref[0]]) ]
+    trackerids[ref[0]].append (str (ref[1]))
+  # print full query URLs, after the list if bugs were listed while reading
+  if not stream and config.get ('show-query', False) and config.get ('format', 'text') == 'text':
+    for bugurl, ids in fullurls:
+      print bugurl + ','.join (ids)
+  # print bug summaries
+  if showlist:
+    if not stream:
+      for ref in refs:
+        lister.add (*ref)
+    lister.flush()
+    lister.output (True)
+  if stream and config.get ('show-query', False) and config.get ('format', 'text') == 'text':
+    for bugurl, ids in fullurls:
+      print bugurl + ','.join (ids)
+
+# import or search the full-text index, bugs of `url` are listed unqualified
+def handle_index (config, url):
+  index = BugIndex (config['index-file'])
+  if config['import']:
+    for alias, bugurl in bugurls:
+      if bugurl == url:
+        print "%s: %u bugs imported" % (alias, index.refresh (url))
+        break
+  if config['search']:
+    aliases = {}
+    for alias, bugurl in bugurls:
+      aliases.setdefault (bugurl, alias)
+    for bugurl, bug, summary in index.search (config['search'], url):
+      print_bug (bug if bugurl == url else '%s#%u' % (aliases.get (bugurl, '?'), bug), summary)
+
+# connection to buglist --serve, reads JSON lookup requests and writes JSON replies line by line
+def service_handler (service):
+  import SocketServer
+  class ServiceHandler (SocketServer.StreamRequestHandler):
+    def handle (self):
+      for line in iter (self.rfile.readline, ''):
+        try:
+          request = json.loads (line)
+          columns = [ c.encode ('utf-8') for c in request.get ('columns') or [] ]
+          found = service.lookup (request['tracker'].encode ('utf-8'), [ int (b) for b in request['bugs'] ], columns)
+          reply = { 'found': dict ([ (str (b), v) for b, v in found.items() ]) }
+        except (ValueError, KeyError, TypeError, IOError), err:
+          reply = { 'error': str (err) }
+        self.wfile.write (json.dumps (reply) + '\n')
+        self.wfile.flush()
+  return ServiceHandler
+
+# serve bug lookups on a Unix socket or TCP port until interrupted
+def serve (config):
+  import SocketServer
+  family, address = parse_address (config['serve'])
+  if family == socket.AF_UNIX:
+    try:
+      mode = os.lstat (address).st_mode
+    except OSError:
+      mode = None
+    if mode is not None and not stat.S_ISSOCK (mode):
+      print >>sys.stderr, "%s: %s: File exists and is not a socket" % (os.path.basename (sys.argv[0]), address)
+      sys.exit (1)
+    if mode is not None:
+      os.unlink (address)       # stale socket of a previous server
+    server_class = SocketServer.ThreadingUnixStreamServer
+  else:
+    server_class = SocketServer.ThreadingTCPServer
+  server_class.daemon_threads = True
+  server_class.allow_reuse_address = True
+  try:
+    server = server_class (address, service_handler (BugService (config)))
+  except socket.error, err:
+    print >>sys.stderr, "%s: %s: %s" % (os.path.basename (sys.argv[0]), config['serve'], str (err))
+    sys.exit (1)
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  if family == socket.AF_UNIX:
+    os.unlink (address)
 
 def help (version = False, verbose = False):
   print "buglist %s" % pkginstall_configvars['VERSION']
   print "Redistributable under GNU GPLv3 or later: http://gnu.org/licenses/gpl.html"
   if version: # version *only*
     return
-  print "Usage: %s [options] <BUG-TRACKER> " % os.path.basename (sys.argv[0])
+  print "Usage: %s [options] [BUG-TRACKER]" % os.path.basename (sys.argv[0])
   print "List or download bugs from a bug tracker. Bug numbers are read from stdin."
+  print "Numbers qualified by a bug tracker, e.g. gb#123 or moz:456, refer to that"
+  print "tracker, other numbers refer to BUG-TRACKER."
   if not verbose:
     print "Use the --help option for verbose usage information."
     return
@@ -155,7 +825,23 @@ def help (version = False, verbose = False):
   print "Options:"
   print "  -h, --help                 Print verbose help message."
   print "  -v, --version              Print version information."
-  print "  -U                         Keep bug list unsorted."
+  print "  -U                         Keep bug list unsorted, list bugs while reading"
+  print "                             and print the query URLs last."
+  print "  -j, --jobs=N               Number of concurrent queries (4)."
+  print "  --max-url=N                Split queries into URLs of at most N chars (2000)."
+  print "  --cache=FILE               Cache bug summaries in FILE (%s)." % cache_file().replace (os.path.expanduser ('~'), '~')
+  print "  --no-cache                 Neither use nor update the cache."
+  print "  --ttl=SECONDS              Query bugs cached longer than SECONDS (86400)."
+  print "  --offline                  List cached summaries only, marks others (OFFLINE)."
+  print "  --import                   Import or refresh the full-text index of BUG-TRACKER."
+  print "  --search=QUERY             List indexed bugs with summaries matching QUERY."
+  print "  --index=FILE               Full-text index file (%s)." % index_file().replace (os.path.expanduser ('~'), '~')
+  print "  --columns=COLUMNS          Query and list the comma separated Bugzilla"
+  print "                             columns, e.g. bug_status,resolution,short_desc."
+  print "  --format=FORMAT            List bugs as 'text', 'jsonl' or 'csv' records."
+  print "  --serve=ADDRESS            Serve bug lookups on [HOST:]PORT or on a Unix"
+  print "                             socket path, coalescing concurrent queries."
+  print "  --connect=ADDRESS          Look up bugs through a buglist --serve process."
   print "  --bug-tracker-list         List supported bug trackers."
   print "Authentication:"
   print "  An INI-style config file is used to associate bugzilla URLs with account"
@@ -174,10 +860,25 @@ def main ():
     'sort' :            True,
     'show-query' :      True,
     'show-list' :       True,
+    'jobs' :            4,
+    'max-url' :         2000,
+    'cache-file' :      cache_file(),
+    'ttl' :             86400,
+    'offline' :         False,
+    'index-file' :      index_file(),
+    'import' :          False,
+    'search' :          None,
+    'columns' :         None,
+    'format' :          'text',
+    'serve' :           None,
+    'connect' :         None,
   }
   # parse options
   try:
-    options, args = getopt.gnu_getopt (sys.argv[1:], 'vhU', [ 'help', 'version', 'bug-tracker-list' ])
+    options, args = getopt.gnu_getopt (sys.argv[1:], 'vhUj:', [ 'help', 'version', 'bug-tracker-list', 'jobs=', 'max-url=',
+                                                                  'cache=', 'no-cache', 'ttl=', 'offline',
+                                                                  'import', 'search=', 'index=', 'columns=', 'format=',
+                                                                  'serve=', 'connect=' ])
   except getopt.GetoptError, err:
     print >>sys.stderr, "%s: %s" % (os.path.basename (sys.argv[0]), str (err))
     help()
@@ -186,21 +887,65 @@ def main ():
     if arg == '-h' or arg == '--help': help (verbose=True); sys.exit (0)
     if arg == '-v' or arg == '--version': help (version=True); sys.exit (0)
     if arg == '-U': config['sort'] = False
+    if arg == '-j' or arg == '--jobs': config['jobs'] = max (1, int (val))
+    if arg == '--max-url': config['max-url'] = max (100, int (val))
+    if arg == '--cache': config['cache-file'] = val
+    if arg == '--no-cache': config['cache-file'] = None
+    if arg == '--ttl': config['ttl'] = float (val)
+    if arg == '--offline': config['offline'] = True
+    if arg == '--import': config['import'] = True
+    if arg == '--search': config['search'] = val
+    if arg == '--index': config['index-file'] = val
+    if arg == '--columns': config['columns'] = [ c.strip() for c in val.split (',') if c.strip() and c.strip() != 'bug_id' ]
+    if arg == '--serve': config['serve'] = val
+    if arg == '--connect': config['connect'] = val
+    if arg == '--format':
+      if not val in ('text', 'jsonl', 'csv'):
+        print >>sys.stderr, "%s: Unknown format: %s" % (os.path.basename (sys.argv[0]), val)
+        sys.exit (126)
+      config['format'] = val
     if arg == '--bug-tracker-list':
       print "Bug Tracker:"
       for kv in bugurls:
         print "  %-20s %s" % kv
       sys.exit (0)
-  if len (args) < 1:
-    print >>sys.stderr, "%s: Missing bug tracker argument" % os.path.basename (sys.argv[0])
+  if len (args) > 1:
+    print >>sys.stderr, "%s: Too many arguments" % os.path.basename (sys.argv[0])
     help()
     sys.exit (126)
   trackerdict = dict (bugurls)
-  if not trackerdict.has_key (args[0]):
+  if args and not trackerdict.has_key (args[0]):
     print >>sys.stderr, "%s: Unknown bug tracker: %s" % (os.path.basename (sys.argv[0]), args[0])
     sys.exit (10)
+  # full-text index
+  if config['import'] and not args:
+    print >>sys.stderr, "%s: Missing bug tracker argument" % os.path.basename (sys.argv[0])
+    sys.exit (126)
+  if config['import'] or config['search']:
+    handle_index (config, trackerdict[args[0]] if args else None)
+    sys.exit (0)
+  # lookup service
+  if config['serve']:
+    serve (config)
+    sys.exit (0)
+  if config['connect']:
+    try:
+      config['service'] = ServiceClient (config['connect'])
+    except (socket.error, ValueError), err:
+      print >>sys.stderr, "%s: %s: %s" % (os.path.basename (sys.argv[0]), config['connect'], str (err))
+  # open summary cache
+  if config['cache-file'] and not config.get ('service'):
+    import sqlite3
+    try:
+      config['cache'] = BugCache (config['cache-file'], config['ttl'])
+    except (sqlite3.Error, OSError), err:
+      print >>sys.stderr, "%s: %s: %s" % (os.path.basename (sys.argv[0]), config['cache-file'], str (err))
   # handle bugs
-  read_handle_bugs (config, trackerdict[args[0]])
+  if not args and sys.stdin.isatty():
+    print >>sys.stderr, "%s: Missing bug tracker argument" % os.path.basename (sys.argv[0])
+    help()
+    sys.exit (126)
+  read_handle_bugs (config, trackerdict[args[0]] if args else None)
 
 if __name__ == '__main__':
   main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 Tim Janik
+# Redistributable under GNU GPLv3 or later: http://www.gnu.org/licenses/gpl.html
+import sys, os, getopt, time, datetime, zlib, urlparse, BaseHTTPServer, SocketServer
+
+# column layouts of buglist.cgi?ctype=csv responses
+layouts = {
+  'default' : [ 'bug_id', 'bug_severity', 'priority', 'op_sys', 'assigned_to', 'bug_status', 'resolution', 'short_desc' ],
+  'short'   : [ 'bug_id', 'bug_severity', 'priority', 'assigned_to', 'bug_status', 'short_short_desc' ],
+  'minimal' : [ 'bug_id', 'short_desc' ],
+}
+
+words = ('crash', 'leak', 'widget', 'render', 'socket', 'timeout', 'theme', 'font', 'scroll', 'menu', 'print',
+         'locale', 'build', 'docs', 'icon', 'focus', 'resize', 'cursor', 'thread', 'window', 'clipboard', 'drag')
+
+# synthetic bug database, bugs 1..rows exist, column values are derived from the bug id
+class BugDatabase:
+  def __init__ (self, rows):
+    self.rows = rows
+    self.epoch = datetime.datetime (2011, 1, 1)
+  def exists (self, bug):
+    return 0 < bug <= self.rows
+  def column (self, bug, column):
+    if column == 'bug_id':
+      return str (bug)
+    if column == 'bug_severity':
+      return ('normal', 'minor', 'major', 'critical', 'enhancement')[bug % 5]
+    if column == 'priority':
+      return ('P1', 'P2', 'P3', 'P4', 'P5')[bug * 7 % 5]
+    if column == 'op_sys':
+      return ('Linux', 'All', 'Windows')[bug % 3]
+    if column == 'assigned_to':
+      return 'dev%u@example.com' % (bug * 13 % 17)
+    if column == 'bug_status':
+      return ('NEW', 'ASSIGNED', 'RESOLVED', 'REOPENED', 'VERIFIED', 'NEW')[bug % 6]
+    if column == 'resolution':
+      return ('', '', 'FIXED', '', 'FIXED', 'WONTFIX')[bug % 6]
+    if column == 'changeddate':
+      return (self.epoch + datetime.timedelta (minutes = bug)).strftime ('%Y-%m-%d %H:%M:%S')
+    if column in ('short_desc', 'short_short_desc'):
+      n = len (words)
+      desc = 'Bug %u: %s "%s" %s in %s' % (bug, words[bug % n], words[bug * 7 % n], words[bug * 11 % n], words[bug * 3 % n])
+      return desc[:60] if column == 'short_short_desc' else desc + ' when using %s' % words[bug * 5 % n]
+    return ''
+  def select (self, query):
+    # bug ids matching buglist.cgi parameters, either an explicit bug_id list or a paged export
+    if query.has_key ('bug_id') or query.has_key ('id'):
+      ids = (query.get ('bug_id') or query.get ('id'))[0]
+      return [ int (b) for b in ids.split (',') if b.strip().isdigit() and self.exists (int (b)) ]
+    first = int (query['v1'][0]) + 1 if query.get ('f1') == [ 'bug_id' ] and query.has_key ('v1') else 1
+    if query.has_key ('chfieldfrom'):
+      since = query['chfieldfrom'][0]
+      while first <= self.rows and self.column (first, 'changeddate') < since:
+        first += 1
+    first += int (query.get ('offset', [ '0' ])[0])
+    last = min (self.rows, first + int (query.get ('limit', [ str (self.rows) ])[0]) - 1)
+    return xrange (first, last + 1)
+
+# CSV field quoting like Bugzilla, all but the bug_id column are quoted
+def csv_quote (value):
+  return '"' + value.replace ('"', '""') + '"'
+
+# buglist.cgi request handler of a FakeBugzilla server
+class BuglistHandler (BaseHTTPServer.BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'   # keep-alive
+  def log_message (self, format, *args):
+    if self.server.verbose:
+      BaseHTTPServer.BaseHTTPRequestHandler.log_message (self, format, *args)
+  def do_GET (self):
+    url = urlparse.urlsplit (self.path)
+    if not url.path.endswith ('/buglist.cgi'):
+      return self.send_error (404)
+    query = urlparse.parse_qs (url.query)
+    if self.server.latency:
+      time.sleep (self.server.latency)
+    columns = self.server.columns
+    if query.has_key ('columnlist'):
+      columns = [ 'bug_id' ] + [ c for c in query['columnlist'][0].split (',') if c and c != 'bug_id' ]
+    db = self.server.database
+    lines = [ ','.join ([ columns[0] ] + [ csv_quote (c) for c in columns[1:] ]) ]
+    for bug in db.select (query):
+      lines.append (','.join ([ str (bug) ] + [ csv_quote (db.column (bug, c)) for c in columns[1:] ]))
+    body = '\n'.join (lines) + '\n'
+    self.send_response (200)
+    self.send_header ('Content-Type', 'text/csv; charset=UTF-8')
+    if 'gzip' in (self.headers.getheader ('accept-encoding') or ''):
+      gz = zlib.compressobj (6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+      body = gz.compress (body) + gz.flush()
+      self.send_header ('Content-Encoding', 'gzip')
+    self.send_header ('Content-Length', str (len (body)))
+    self.end_headers()
+    self.wfile.write (body)
+
+# threaded HTTP server with a synthetic bug database
+class FakeBugzilla (SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+  def __init__ (self, address, rows = 100000, latency = 0, layout = 'default', verbose = False):
+    BaseHTTPServer.HTTPServer.__init__ (self, address, BuglistHandler)
+    self.database = BugDatabase (rows)
+    self.latency, self.columns, self.verbose = latency, layouts[layout], verbose
+  def url (self):
+    # bug list URL for buglist.py bugurls
+    return 'http://%s:%u/buglist.cgi?bug_id=' % self.server_address[:2]
+
+usage = '''Usage: fakebugzilla.py [Options]
+Serve buglist.cgi?ctype=csv responses from a synthetic bug database with bugs
+1..ROWS, e.g. to test or benchmark buglist.py. The bug list URL is printed.
+  -p, --port <PORT>       TCP port on localhost, 0 picks a free port (8080)
+  -r, --rows <ROWS>       Number of bugs in the database (100000)
+  -l, --latency <SECS>    Delay of each response (0)
+  -c, --columns <LAYOUT>  CSV columns: default, short (short_short_desc) or
+                          minimal, unless a query has a columnlist
+  -v, --verbose           Log requests'''
+
+def main (argv):
+  options, args = getopt.gnu_getopt (argv[1:], 'hp:r:l:c:v', [ 'help', 'port=', 'rows=', 'latency=', 'columns=', 'verbose' ])
+  port, rows, latency, layout, verbose = 8080, 100000, 0.0, 'default', False
+  for k, v in options:
+    if   k in ('-h', '--help'):         print usage; return 0
+    elif k in ('-p', '--port'):         port = int (v)
+    elif k in ('-r', '--rows'):         rows = int (v)
+    elif k in ('-l', '--latency'):      latency = float (v)
+    elif k in ('-c', '--columns'):      layout = v
+    elif k in ('-v', '--verbose'):      verbose = True
+  if args or not layouts.has_key (layout):
+    print usage
+    return 1
+  server = FakeBugzilla (('127.0.0.1', port), rows, latency, layout, verbose)
+  print server.url()
+  sys.stdout.flush()
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  return 0
+
+if __name__ == '__main__':
+  sys.exit (main (sys.argv))
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 Tim Janik
+# Redistributable under GNU GPLv3 or later: http://www.gnu.org/licenses/gpl.html
+import sys, os, time
+from xml.etree import ElementTree
+sys.path.insert (0, os.path.dirname (os.path.abspath (__file__)))
+import wikihtml2man
+
+# Synthetic Mediawiki style manual page with an option reference of `count` entries
+def synthetic_page (count):
+  page = [ '<html><body><div id="content"><h1>frob(1) - Frobnication Manual</h1>',
+           '<p>Updated: 2011-9-3<br/>Release: frob-1.0<br/>Manual: Frob Tools</p>',
+           '<div id="bodyContent"><h2><span class="editsection">[edit]</span> NAME </h2>',
+           '<p>frob - frobnicate files</p><h2>SYNOPSIS</h2><p><b>frob</b> [<i>OPTIONS</i>] files...</p>',
+           '<h2>OPTIONS</h2><dl>' ]
+  for i in range (count):
+    page.append ('<dt><b>--option-%u</b>=<i>VALUE</i></dt>' % i)
+    page.append ('<dd>Set frobnication parameter %u, see <a href="#opt%u">option %u</a>.\n' % (i, i + 1, i + 1))
+    if i % 10 == 0:
+      page.append ('<pre>frob --option-%u=%u  file.txt\n</pre>' % (i, i))
+    page.append (' The default is <b>%u</b>. </dd>' % (i * 7))
+  page.append ('</dl><h2>SEE ALSO</h2><p><a href="http://example.org/frob">frob online</a></p>')
+  page.append ('<div class="printfooter">Retrieved from somewhere</div></div></div></body></html>')
+  return ''.join (page)
+
+# Convert a synthetic page, returns roff output and the seconds spent in heuristics and events
+def convert (count):
+  root = ElementTree.fromstring (synthetic_page (count))
+  wikihtml2man.gman_name_parent = wikihtml2man.gman_name_node = None
+  wikihtml2man.gman_pagetitle = ''
+  t0 = time.time()
+  wikihtml2man.gman_heuristics (root)
+  mev = wikihtml2man.ManEvents()
+  wikihtml2man.xml2events (root, mev)
+  out = mev.output()
+  return out, time.time() - t0
+
+usage = '''Usage: benchmark.py [COUNT...]
+Time wikihtml2man.py roff generation for synthetic manual pages with COUNT
+options each (1000 10000).'''
+
+def main (argv):
+  if len (argv) > 1 and argv[1] in ('-h', '--help'):
+    print usage
+    return 0
+  counts = [ int (float (a)) for a in argv[1:] ] or [ 1000, 10000 ]
+  print '%-9s %10s %10s %12s' % ('options', 'seconds', 'us/option', 'roff bytes')
+  for count in counts:
+    out, seconds = convert (count)
+    assert out.count ('\n.TP\n') == count
+    print '%-9u %9.3fs %10.1f %12u' % (count, seconds, seconds * 1e6 / count, len (out))
+  return 0
+
+if __name__ == '__main__':
+  sys.exit (main (sys.argv))
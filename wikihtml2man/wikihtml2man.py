@@ -56,8 +56,11 @@ gman_server_path = ''
 # * Try to match man page title and section from a header preceeding 'NAME'.
 # * Try to parse Updated, Release, Manual bits from title header section.
 def gman_heuristics (node):
-  capture = [] # title section contents
+  capture = [] # title section contents, as list of text pieces
   gman_script_path = ''
+  def captured():               # join capture pieces, appending stays linear
+    capture[0][:] = [ ''.join (capture[0]) ]
+    return capture[0][0]
   def recurse (node, parent):
     global gman_name_parent, gman_name_node, gman_name_def
     global gman_pagetitle, gman_section, gman_updated, gman_origin, gman_manual
@@ -66,20 +69,20 @@ def gman_heuristics (node):
     text = textr (node)
     start_capture = False
     if capture:
-      capture[0] += node.text if isinstance (node.text, basestring) else ''
+      capture[0].append (node.text if isinstance (node.text, basestring) else '')
     if tag.lower() in headings:
       if capture and gman_name_node is not None: # previous heading was NAME section
         # match ' EXECUTABLE - DESCRIPTIVE BLURB '
-        m = re.match (r'\s*([_a-zA-Z0-9][_a-zA-Z0-9-]+)\s+-\s+([^\s].*?)\s*$', capture[0])
+        m = re.match (r'\s*([_a-zA-Z0-9][_a-zA-Z0-9-]+)\s+-\s+([^\s].*?)\s*$', captured())
         if m:
           gman_name_def = m.groups()
       elif capture and gman_pagetitle:   # previous heading was title section
-        capture[0] += '\n'
-        m = re.search ('\nUpdated:\s+([^\n]+?)\s*\n', capture[0])
+        capture[0].append ('\n')
+        m = re.search ('\nUpdated:\s+([^\n]+?)\s*\n', captured())
         gman_updated = m.group (1) if m else gman_updated
-        m = re.search ('\n(Resource|Release):\s+([^\n]+?)\s*\n', capture[0])
+        m = re.search ('\n(Resource|Release):\s+([^\n]+?)\s*\n', captured())
         gman_origin = m.group (2) if m else gman_origin
-        m = re.search ('\nManual:\s+([^\n]+?)\s*\n', capture[0])
+        m = re.search ('\nManual:\s+([^\n]+?)\s*\n', captured())
         gman_manual = m.group (1) if m else gman_manual
         capture.pop()
       text = re.sub (r'\[edit\]', '', text)
@@ -95,13 +98,13 @@ def gman_heuristics (node):
           gman_section = m.group (2)
           start_capture = True
     elif tag.lower() == 'br' and capture:
-      capture[0] += '\n'
+      capture[0].append ('\n')
     for c in node.getchildren():
       recurse (c, node)
     if start_capture:   # capture tail, but not children contents
-      capture.insert (0, '\n')
+      capture.insert (0, [ '\n' ])
     if capture:
-      capture[0] += node.tail if isinstance (node.tail, basestring) else ''
+      capture[0].append (node.tail if isinstance (node.tail, basestring) else '')
     if tag == 'script' and text:
       global gman_server_path, gman_script_path
       m = re.search (r'\bwgScriptPath\s*=\s*"([^"]*)"\s*[,;]', text)
@@ -153,7 +156,9 @@ class XmlEventDebug:
 
 # === ManEvents ===
 # Generate roff markup from XML events by matching corresponding
-# HTML elements.
+# HTML elements. The output is kept as a list of chunks, trimming
+# and section name extraction only look at the end of the list, so
+# long pages are converted in linear time.
 HEADINGS = ('h1', 'h2')
 SUBHEADS = ('h3', 'h4', 'h5', 'h6')
 PREFORMS = ('pre')
@@ -161,7 +166,8 @@ ITALICS = ('i')
 BOLDS = ('b')
 class ManEvents:
   def __init__ (self):
-    self.out = u''
+    self.chunks = []    # output pieces, never empty
+    self.length = 0     # output length
     self.transforms = []
     self.nest = 0
     self.list = 'bullet'
@@ -170,6 +176,26 @@ class ManEvents:
     self.preserve = 0
     self.sstart = 0
     self.sname = '' # section name
+  def append (self, s):
+    if s:
+      self.chunks.append (s)
+      self.length += len (s)
+  def tail (self, n = 1):       # last n characters of the output
+    s, i = u'', len (self.chunks)
+    while len (s) < n and i > 0:
+      i -= 1
+      s = self.chunks[i] + s
+    return s[-n:]
+  def since (self, start):      # output from offset start on
+    parts, i, pos = [], len (self.chunks), self.length
+    while i > 0 and pos > start:
+      i -= 1
+      pos -= len (self.chunks[i])
+      parts.append (self.chunks[i])
+    parts.reverse()
+    return u''.join (parts)[max (0, start - pos):]
+  def output (self):
+    return u''.join (self.chunks)
   def push (self, transform):
     self.transforms += [ transform ]
   def pop (self):
@@ -182,11 +208,18 @@ class ManEvents:
     return q
   def rstrip (self):            return self.rstripa()
   def rstripa (self, append = ''):
-    self.out = self.out.rstrip() + append
+    while self.chunks:
+      last = self.chunks.pop()
+      self.length -= len (last)
+      last = last.rstrip()
+      if last:
+        self.append (last)
+        break
+    self.append (append)
   def nlappend (self, append):
-    if not self.out or self.out[-1] != '\n':
-      self.out += '\n'
-    self.out += append
+    if self.tail() != '\n':
+      self.append ('\n')
+    self.append (append)
   def nesting (self, delta):
     self.nest += delta
     if delta > 0 and self.nest > 1:
@@ -209,36 +242,36 @@ class ManEvents:
     elif re.search (r'\beditsection\b', attrib.get ('class', '')):      self.ignore += 1
     elif re.search (r'\bprintfooter\b', attrib.get ('class', '')):      self.ignore = 9999999 # done
     if self.ignore:                     return
-    elif tag.lower() in HEADINGS:       self.nlappend ('\n.SH '); self.push (self.tupper); self.sstart = len (self.out)
-    elif tag.lower() in SUBHEADS:       self.nlappend ('.SS '); self.sstart = len (self.out)
-    elif tag.lower() == BOLDS:          self.out += r'\fB'
-    elif tag.lower() == ITALICS:        self.out += r'\fI'
+    elif tag.lower() in HEADINGS:       self.nlappend ('\n.SH '); self.push (self.tupper); self.sstart = self.length
+    elif tag.lower() in SUBHEADS:       self.nlappend ('.SS '); self.sstart = self.length
+    elif tag.lower() == BOLDS:          self.append (r'\fB')
+    elif tag.lower() == ITALICS:        self.append (r'\fI')
     elif tag.lower() == PREFORMS:       self.rstripa ('\n.EX\n'); self.preserve += 1
     elif tag.lower() == 'dt':           self.rstripa ('\n.TP\n'); self.push (self.tlstrip)
     elif tag.lower() == 'dd':           self.rstripa ('\n'); self.push (self.tlstrip)
-    elif tag.lower() == 'br':           self.out += '\n.br\n'
+    elif tag.lower() == 'br':           self.append ('\n.br\n')
     elif tag.lower() == 'dl':           self.nesting (+1)
     elif tag.lower() == 'ul':           self.list = 'bullet'; self.listn = 0
     elif tag.lower() == 'ol':           self.list = 'number'; self.listn = 0
     elif tag.lower() == 'li':           self.listitem(); self.push (self.tlstrip)
-    elif tag.lower() == 'p' and not self.out.endswith('\n\n'): self.nlappend ('\n')
+    elif tag.lower() == 'p' and self.tail (2) != '\n\n': self.nlappend ('\n')
     elif tag.lower() == 'a':
       if self.uselink (attrib):         pass # self.nlappend ('.UR ' + attrib['href'] + '\n')
-      else:                             self.out += r'\fI'
+      else:                             self.append (r'\fI')
   def end (self, tag, attrib):          # closing tag
     if self.ignore:                     self.ignore -= 1; return
-    elif tag.lower() in HEADINGS:       self.rstripa ('\n'); self.pop(); self.sname = self.out[self.sstart:]
-    elif tag.lower() in SUBHEADS:       self.rstripa ('\n'); self.sname = self.out[self.sstart:]
-    elif tag.lower() == BOLDS:          self.out += r'\fR'
-    elif tag.lower() == ITALICS:        self.out += r'\fR'
+    elif tag.lower() in HEADINGS:       self.rstripa ('\n'); self.pop(); self.sname = self.since (self.sstart)
+    elif tag.lower() in SUBHEADS:       self.rstripa ('\n'); self.sname = self.since (self.sstart)
+    elif tag.lower() == BOLDS:          self.append (r'\fR')
+    elif tag.lower() == ITALICS:        self.append (r'\fR')
     elif tag.lower() == PREFORMS:       self.nlappend ('.EE\n'); self.preserve -= 1
     elif tag.lower() == 'dt':           self.rstripa ('\n'); self.pop()
     elif tag.lower() == 'dd':           self.rstripa ('\n.PP\n'); self.pop()
     elif tag.lower() == 'dl':           self.nesting (-1)
     elif tag.lower() == 'li':           self.pop()
     elif tag.lower() == 'a':
-      if self.uselink (attrib):         self.out += ' <%s>' % attrib['href'] # self.nlappend ('.UE\n')
-      else:                             self.out += r'\fR'
+      if self.uselink (attrib):         self.append (' <%s>' % attrib['href']) # self.nlappend ('.UE\n')
+      else:                             self.append (r'\fR')
   def data (self, data):                # text?
     if self.ignore: return
     s = unicode (data)
@@ -247,15 +280,15 @@ class ManEvents:
       s = self.transforms[i] (s, i)
       i += 1
     if self.preserve:
-      self.out += s
+      self.append (s)
     else:
       self.compressa (s)
   def compressa (self, s):
     s = re.sub (r'[ \t]+', ' ', s)
     s = re.sub (r'[ \t]*\n+[ \t]*', r'\n', s)
-    if len (self.out) and self.out[-1] in ' \t\n':
+    if self.tail() and self.tail() in ' \t\n':
       s = s.lstrip()
-    self.out += s
+    self.append (s)
   def close (self):                     # XMLParser.close
     pass
 
@@ -337,7 +370,7 @@ def main (argv = ()):
   if th[2] == None: th[2] = gman_updated
   if th[3] == None: th[3] = gman_origin
   if th[4] == None: th[4] = gman_manual
-  mpage = gen_man_title (*th) + mev.out
+  mpage = gen_man_title (*th) + mev.output()
   # output
   print unicode (mpage).encode ('utf8', 'ignore')
   return 0